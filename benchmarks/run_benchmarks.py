@@ -0,0 +1,377 @@
+"""
+Benchmarks for the hot paths of the eGRF/TPL workflow.
+
+The benchmarks run offline on a single CPU without OGS5, which is replaced
+by synthetic PVD/VTU output on the radial mesh of the ensemble simulations.
+The timings are compared to the stored baseline (``baseline.json``) and
+regressions are reported. Scaling curves over the mesh and ensemble size
+are written to ``results/benchmarks``.
+
+Usage::
+
+    python run_benchmarks.py                 # compare to the baseline
+    python run_benchmarks.py --save          # store a new baseline
+    python run_benchmarks.py -k tpl          # select benchmarks by name
+    python run_benchmarks.py --scaling       # scaling curves
+"""
+import os
+import io
+import sys
+import json
+import time as timer
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import importlib.util
+import numpy as np
+from ogs5py import MSH, OGS
+import gstools as gs
+import anaflow as ana
+from anaflow.tools.coarse_graining import TPL_CG, TPL_CG_error
+from anaflow.tools.mean import annular_hmean
+from anaflow.tools.special import specialrange_cut
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "src")
+sys.path[:0] = [SRC, os.path.join(SRC, "comparison")]
+from radial_mean import radial_mean_operator
+from tpl_sweep import ext_theis_tpl_sweep, annular_hmean_gl
+from input_writer import InputWriter
+import tpl_table
+
+BASELINE = os.path.join(HERE, "baseline.json")
+RESULTS = os.path.join(HERE, "..", "results", "benchmarks")
+# registered benchmarks: name -> (setup function, parameter, default, scaling)
+BENCHMARKS = {}
+
+
+def load_script(name):
+    """Import a script of the comparison workflow (names start with digits)."""
+    file = os.path.join(SRC, "comparison", name + ".py")
+    spec = importlib.util.spec_from_file_location(name.lstrip("0123456789_"), file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+RUN = load_script("01_run_sim")
+COMPARE = load_script("02_compare_mean")
+# settings of the comparison in 02_compare_mean.py
+TIME = RUN.time[RUN.time > 60]
+RAD = RUN.rad[(RUN.rad > 0.2) & (RUN.rad < 40)]
+TPL = dict(
+    storage=1e-4,
+    cond_gmean=1e-4,
+    len_scale=10.0,
+    hurst=0.5,
+    var=1.0,
+    rate=-1e-4,
+    parts=30,
+    prop=np.sqrt(np.pi * 2),
+)
+
+
+def benchmark(param, default, scaling=()):
+    """Register a benchmark with a size parameter and its scaling values."""
+
+    def register(setup):
+        BENCHMARKS[setup.__name__] = (setup, param, default, scaling)
+        return setup
+
+    return register
+
+
+def radial_mesh(angles):
+    """Radial mesh of the ensemble simulations with the given angles."""
+    msh = MSH()
+    msh.generate("radial", dim=2, angles=angles, rad=RUN.rad)
+    return msh
+
+
+def write_output(path, msh, time, task_id="model", pcs="GROUNDWATER_FLOW"):
+    """Write synthetic OGS5 output (ASCII VTU with a HEAD field)."""
+    os.makedirs(path, exist_ok=True)
+    points = msh.NODES
+    cells = [msh.ELEMENTS[typ] for typ in ("tri", "quad") if typ in msh.ELEMENTS]
+    connect = np.concatenate([cell.ravel() for cell in cells])
+    offsets = np.cumsum(np.concatenate([np.full(len(c), c.shape[1]) for c in cells]))
+    # VTK cell types: 5 triangle, 9 quad
+    types = np.concatenate([np.full(len(c), 5 if len(c[0]) == 3 else 9) for c in cells])
+    radius = np.hypot(points[:, 0], points[:, 1]) + 1e-3
+    angle = np.arctan2(points[:, 1], points[:, 0])
+
+    def array(values, fmt, **attrs):
+        attrs = " ".join('{}="{}"'.format(*item) for item in attrs.items())
+        values = " ".join(fmt % val for val in np.ravel(values))
+        return '<DataArray {} format="ascii">\n{}\n</DataArray>\n'.format(attrs, values)
+
+    files = []
+    for step, step_time in enumerate(time):
+        head = step_time / time[-1] * np.log(radius / 1000) * 1e-4 / (2 * np.pi)
+        head += 1e-3 * np.cos(angle)  # angular variation
+        files.append("{}_{}{}.vtu".format(task_id, pcs, step))
+        with open(os.path.join(path, files[-1]), "w") as vtu:
+            vtu.write(
+                '<?xml version="1.0"?>\n<VTKFile type="UnstructuredGrid" '
+                'version="0.1" byte_order="LittleEndian">\n<UnstructuredGrid>\n'
+                '<Piece NumberOfPoints="{}" NumberOfCells="{}">\n<Points>\n'.format(
+                    len(points), len(types)
+                )
+            )
+            vtu.write(array(points, "%.14g", type="Float64", NumberOfComponents=3))
+            vtu.write("</Points>\n<Cells>\n")
+            vtu.write(array(connect, "%d", type="Int64", Name="connectivity"))
+            vtu.write(array(offsets, "%d", type="Int64", Name="offsets"))
+            vtu.write(array(types, "%d", type="UInt8", Name="types"))
+            vtu.write('</Cells>\n<PointData Scalars="HEAD">\n')
+            vtu.write(array(head, "%.14g", type="Float64", Name="HEAD"))
+            vtu.write("</PointData>\n</Piece>\n</UnstructuredGrid>\n</VTKFile>\n")
+    with open(os.path.join(path, "{}_{}.pvd".format(task_id, pcs)), "w") as pvd:
+        pvd.write(
+            '<?xml version="1.0"?>\n<VTKFile type="Collection" version="0.1" '
+            'byte_order="LittleEndian">\n<Collection>\n'
+        )
+        for step_time, file in zip(time, files):
+            pvd.write(
+                '<DataSet timestep="{}" group="" part="0" file="{}"/>\n'.format(
+                    step_time, file
+                )
+            )
+        pvd.write("</Collection>\n</VTKFile>\n")
+
+
+@benchmark("angles", 64, scaling=[16, 32, 64, 128])
+def angles_mean(work, angles):
+    """Angular means of the heads of a realization from the OGS5 output."""
+    msh = radial_mesh(angles)
+    write_output(work, msh, RUN.time)
+    rad_op = radial_mean_operator(msh.NODES, RUN.rad)
+    return lambda: RUN.angles_mean(RUN.time, rad_op, work, save=False)
+
+
+@benchmark("members", 100, scaling=[25, 100, 400])
+def calc_ensemble_mean(work, members):
+    """Ensemble mean from the angular means of all members (text files)."""
+    base = os.path.join(work, "ensemble")
+    os.makedirs(base)
+    np.savetxt(os.path.join(base, "time.txt"), RUN.time)
+    np.savetxt(os.path.join(base, "rad.txt"), RUN.rad)
+    rng = np.random.default_rng(members)
+    for seed_no in range(members):
+        seed = os.path.join(base, "para0000", "seed{:04}".format(seed_no))
+        os.makedirs(seed)
+        head = rng.normal(size=(len(RUN.time), len(RUN.rad)))
+        np.savetxt(os.path.join(seed, "rad_mean_head.txt"), head)
+
+    def run():
+        COMPARE.CWD = work
+        with contextlib.redirect_stdout(io.StringIO()):
+            COMPARE.calc_ensemble_mean("ensemble")
+
+    return run
+
+
+@benchmark("rad", len(RAD), scaling=[10, 28, 100])
+def ext_theis_tpl(work, rad):
+    """Effective head for TPL fields at the resolution of the comparison."""
+    rad = np.geomspace(RAD[0], RAD[-1], rad)
+    return lambda: ana.ext_theis_tpl(TIME, rad, **TPL)
+
+
+@benchmark("rad", len(RAD), scaling=[10, 28, 100])
+def ext_grf(work, rad):
+    """Extended GRF model with the TPL partitions of the comparison."""
+    rad = np.geomspace(RAD[0], RAD[-1], rad)
+    kw = {key: TPL[key] for key in ("cond_gmean", "len_scale", "hurst", "var")}
+    kw["prop"] = TPL["prop"]
+    R_part = specialrange_cut(0, np.inf, 31, TPL_CG_error(0.01, **kw))
+    K_part = annular_hmean(TPL_CG, R_part, **kw)
+    S_part = np.full_like(K_part, TPL["storage"])
+    K_well = TPL_CG(0.0, **kw)
+    return lambda: ana.ext_grf(
+        TIME, rad, S_part, K_part, R_part, rate=-1e-4, K_well=K_well
+    )
+
+
+@benchmark("paras", 16, scaling=[4, 16, 64])
+def ext_theis_tpl_sweep_paras(work, paras):
+    """Batched effective heads for a sweep over hurst and the storage."""
+    tpl = dict(TPL)
+    tpl["storage"] = np.geomspace(1e-5, 1e-3, paras)
+    tpl["hurst"] = np.linspace(0.1, 0.9, paras)
+    return lambda: ext_theis_tpl_sweep(TIME, RAD, **tpl)
+
+
+@benchmark("parts", 30, scaling=[10, 30, 100])
+def annular_hmean_tpl(work, parts):
+    """Harmonic means of the TPL conductivity over the annuli."""
+    kw = dict(cond_gmean=1e-4, len_scale=10.0, hurst=0.5, var=1.0)
+    R_part = specialrange_cut(0, np.inf, parts + 1, TPL_CG_error(0.01, **kw))
+    return lambda: annular_hmean(TPL_CG, R_part, **kw)
+
+
+@benchmark("parts", 30, scaling=[10, 30, 100])
+def annular_hmean_gl_tpl(work, parts):
+    """Harmonic means over the annuli by the batched Gauss-Legendre rule."""
+    kw = dict(cond_gmean=1e-4, len_scale=10.0, hurst=0.5, var=1.0)
+    R_part = specialrange_cut(0, np.inf, parts + 1, TPL_CG_error(0.01, **kw))
+    return lambda: annular_hmean_gl(TPL_CG, R_part, rtol=1e-8, **kw)
+
+
+@benchmark("rad", 1000, scaling=[100, 1000, 10000])
+def tpl_cg(work, rad):
+    """TPL coarse-graining conductivity by the special functions."""
+    rad = np.geomspace(1e-2, 1e3, rad)
+    return lambda: TPL_CG(rad, 1e-4, 10.0, 0.5, 1.0)
+
+
+@benchmark("rad", 1000, scaling=[100, 1000, 10000])
+def tpl_cg_table(work, rad):
+    """TPL coarse-graining conductivity by the lookup table."""
+    rad = np.geomspace(1e-2, 1e3, rad)
+    tpl_table.TPL_CG(rad, 1e-4, 10.0, 0.5, 1.0)  # load (or build) the table
+    return lambda: tpl_table.TPL_CG(rad, 1e-4, 10.0, 0.5, 1.0)
+
+
+@benchmark("angles", 64, scaling=[16, 32, 64, 128])
+def srf_mesh(work, angles):
+    """TPL field with coarse graining upscaling on the radial mesh."""
+    msh = radial_mesh(angles)
+    model = gs.TPLGaussian(dim=2, var=1.0, len_scale=10, hurst=0.5)
+    srf = gs.SRF(model, mean=np.log(1e-4), upscaling="coarse_graining")
+    return lambda: srf.mesh(msh, seed=1001, point_volumes=msh.volumes_flat)
+
+
+@benchmark("angles", 64, scaling=[16, 32, 64, 128])
+def write_mpd(work, angles):
+    """Element data (mpd) file of a new transmissivity field."""
+    model = OGS(task_root=work, task_id="model")
+    model.mpd.add(name="transmissivity")
+    model.mpd.add_block(
+        MSH_TYPE="GROUNDWATER_FLOW", MMP_TYPE="PERMEABILITY", DIS_TYPE="ELEMENT"
+    )
+    size = radial_mesh(angles).ELEMENT_NO
+    field = np.exp(np.random.default_rng(angles).normal(size=size))
+    writer = InputWriter(model)
+
+    def run():
+        field[0] += 1.0  # a new field in every call
+        writer.write_mpd(field)
+
+    return run
+
+
+def measure(func, repeat=5, min_time=0.2):
+    """Best time of a function over repeated runs (after a warm-up run)."""
+    start = timer.perf_counter()
+    func()
+    duration = timer.perf_counter() - start
+    # less repetitions for long running benchmarks
+    repeat = max(1, min(repeat, int(repeat * min_time / duration)))
+    times = []
+    for __ in range(repeat):
+        start = timer.perf_counter()
+        func()
+        times.append(timer.perf_counter() - start)
+    return min(times)
+
+
+def run(name, value, repeat):
+    """Run a benchmark with the given size in a temporary directory."""
+    setup = BENCHMARKS[name][0]
+    work = tempfile.mkdtemp(prefix="bench_")
+    try:
+        return measure(setup(work, value), repeat)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def machine():
+    """Description of the machine and the versions of the main packages."""
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "gstools": gs.__version__,
+        "anaflow": ana.__version__,
+    }
+
+
+def scaling_curves(names, repeat):
+    """Timings over the scaling values of the selected benchmarks."""
+    os.makedirs(RESULTS, exist_ok=True)
+    for name in names:
+        __, param, __, values = BENCHMARKS[name]
+        times = [run(name, value, repeat) for value in values]
+        print(name)
+        for value, time in zip(values, times):
+            print("  {:>8} = {:<6} {:10.4f} s".format(param, value, time))
+        np.savetxt(
+            os.path.join(RESULTS, "scaling_{}.txt".format(name)),
+            np.column_stack((values, times)),
+            header="{} time[s]".format(param),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-k", "--select", default="", help="only run benchmarks containing this"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="repetitions of each benchmark"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="store the timings as baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="slow-down factor to the baseline reported as regression",
+    )
+    parser.add_argument(
+        "--scaling", action="store_true", help="generate the scaling curves"
+    )
+    args = parser.parse_args()
+    names = [name for name in BENCHMARKS if args.select in name]
+    if args.scaling:
+        scaling_curves(names, args.repeat)
+        return 0
+    baseline = {"benchmarks": {}}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as base:
+            baseline = json.load(base)
+    timings = {}
+    regressions = []
+    for name in names:
+        __, param, default, __ = BENCHMARKS[name]
+        time = timings[name] = run(name, default, args.repeat)
+        line = "{:28} {:>8} = {:<5} {:10.4f} s".format(name, param, default, time)
+        if name in baseline["benchmarks"] and not args.save:
+            ratio = time / baseline["benchmarks"][name]
+            line += "  x{:.2f} of baseline".format(ratio)
+            if ratio > args.threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    if args.save:
+        baseline["machine"] = machine()
+        baseline["benchmarks"].update(
+            {name: float("{:.4g}".format(time)) for name, time in timings.items()}
+        )
+        with open(BASELINE, "w") as base:
+            json.dump(baseline, base, indent=2, sort_keys=True)
+            base.write("\n")
+        print("baseline written to", BASELINE)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
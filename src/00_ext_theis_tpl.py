@@ -2,7 +2,8 @@ import os
 import numpy as np
 import matplotlib as mpl
 from matplotlib import pyplot as plt
-from anaflow import theis, ext_theis_tpl
+from anaflow import theis
+from head_cache import ext_theis_tpl
 
 plt.style.use('default')
 mpl.rc("text", usetex=True)
@@ -2,7 +2,7 @@ import os
 import numpy as np
 import matplotlib as mpl
 from matplotlib import pyplot as plt
-from anaflow import ext_theis_tpl, ext_thiem_tpl
+from head_cache import ext_theis_tpl, ext_thiem_tpl
 
 plt.style.use('default')
 mpl.rc("text", usetex=True)
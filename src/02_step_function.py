@@ -2,9 +2,10 @@ import os
 import numpy as np
 import matplotlib as mpl
 from matplotlib import pyplot as plt
-from anaflow.tools.coarse_graining import TPL_CG, TPL_CG_error, T_CG, T_CG_error
+from anaflow.tools.coarse_graining import TPL_CG, T_CG, T_CG_error
 from anaflow.tools.mean import annular_hmean
-from anaflow.tools.special import specialrange_cut, specialrange, step_f
+from anaflow.tools.special import specialrange, step_f
+from tpl_sweep import adaptive_partitions, tpl_partitions
 
 plt.style.use('default')
 mpl.rc("text", usetex=True)
@@ -21,28 +22,38 @@ rate = -1e-4                 # pumping rate
 dim = 2.0                    # using a fractional dimension
 
 far_err = 0.01               # absolute error for cut-off
-parts = 20                   # number of partitions
+part_tol = 0.02              # relative error of the step functions
+parts = 20                   # maximal number of partitions
 
-# genearte rlast from a given relativ-error to farfield-conductivity
-r_last_tpl = TPL_CG_error(far_err, cond_gmean, len_scale, hurst, var, dim=dim)
-# generate the partition points (with cut-off)
-R_part_tpl = specialrange_cut(0, np.inf, parts + 1, r_last_tpl)
-# calculate the harmonic mean conductivity values within each partition
-K_part_tpl = annular_hmean(
-    TPL_CG,
-    R_part_tpl,
-    ann_dim=dim,
-    cond_gmean=cond_gmean,
-    len_scale=len_scale,
-    hurst=hurst,
-    var=var,
+# generate the partition points (adaptive up to the cut-off from far_err)
+# and the harmonic mean conductivity values within each partition
+R_part_tpl, K_part_tpl, __ = tpl_partitions(
+    cond_gmean,
+    len_scale,
+    hurst,
+    var,
     dim=dim,
+    far_err=far_err,
+    parts=parts,
+    tol=part_tol,
 )
+print("TPL: {} partitions".format(len(K_part_tpl)))
 
 # genearte rlast from a given relativ-error to farfield-conductivity
 r_last = T_CG_error(far_err, cond_gmean, var, len_scale)
-# generate the partition points
-R_part = specialrange_cut(0, np.inf, parts + 1, r_last)
+# generate the partition points (adaptive up to the cut-off)
+R_part = adaptive_partitions(
+    T_CG,
+    0,
+    r_last,
+    part_tol,
+    parts - 1,
+    trans_gmean=cond_gmean,
+    var=var,
+    len_scale=len_scale,
+)
+R_part = np.append(R_part, np.inf)
+print("Gaussian: {} partitions".format(len(R_part) - 1))
 # calculate the harmonic mean conductivity values within each partition
 K_part = annular_hmean(
     T_CG,
@@ -7,7 +7,8 @@ from matplotlib import rc
 from matplotlib.offsetbox import AnchoredText
 from anaflow import ext_grf, ext_grf_steady
 from anaflow.tools import neuman2004_trans, K_CG, T_CG
-from anaflow.tools import specialrange_cut, annular_hmean, step_f
+from anaflow.tools import specialrange_cut, step_f
+from tpl_sweep import annular_hmean_gl
 
 
 plt.style.use('default')
@@ -18,6 +19,10 @@ def dashes(i=1, max_n=12, width=1):
     """Dashes for matplotlib"""
     return i * [width, width] + [max_n * 2 * width - 2 * i * width, width]
 
+def hmean(func, r_part, **kwargs):
+    """Annular harmonic means of all annuli at once (adaptive if inaccurate)"""
+    return annular_hmean_gl(func, r_part, rtol=1e-8, **kwargs)[0]
+
 class sol_container:
     """Container to store all information about an eGRF solution."""
     def __init__(self, r_part, t_part, storage, label, title, t_w=None, trans=None):
@@ -92,7 +97,7 @@ solutions.append(sol)
 sol = sol_container(
     trans=lambda r: neuman2004_trans(r, trans_gmean=K_far, var=var, len_scale=len_scale),
     r_part=R_part,
-    t_part=annular_hmean(neuman2004_trans, R_part, ann_dim=2, trans_gmean=K_far, var=var, len_scale=len_scale),
+    t_part=hmean(neuman2004_trans, R_part, ann_dim=2, trans_gmean=K_far, var=var, len_scale=len_scale),
     storage=S,
     label=r"\textit{Neuman et al. (2004)}",
     title="D",
@@ -102,7 +107,7 @@ solutions.append(sol)
 sol = sol_container(
     trans=lambda r: T_CG(r, trans_gmean=K_far, var=var, T_well=K_well, len_scale=len_scale),
     r_part=R_part,
-    t_part=annular_hmean(T_CG, R_part, ann_dim=2, trans_gmean=K_far, var=var, T_well=K_well, len_scale=len_scale),
+    t_part=hmean(T_CG, R_part, ann_dim=2, trans_gmean=K_far, var=var, T_well=K_well, len_scale=len_scale),
     storage=S,
     label=r"\textit{Schneider \& Attinger (2008)}",
     title="E",
@@ -112,7 +117,7 @@ solutions.append(sol)
 sol = sol_container(
     trans=lambda r: K_CG(r, cond_gmean=K_g3d, var=1, anis=1, K_well=K_well, len_scale=len_scale),
     r_part=R_part,
-    t_part=annular_hmean(K_CG, R_part, ann_dim=2, cond_gmean=K_g3d, var=1, anis=1, K_well=K_well, len_scale=len_scale),
+    t_part=hmean(K_CG, R_part, ann_dim=2, cond_gmean=K_g3d, var=1, anis=1, K_well=K_well, len_scale=len_scale),
     storage=S,
     label=r"\textit{Zech et al. (2012)}",
     title="F",
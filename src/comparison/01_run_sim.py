@@ -1,38 +1,914 @@
 """Generate a TPL ensemble of drawdowns with ogs5py and GSTools."""
 import os
+import copy
+import glob
 import shutil
+import argparse
+import tempfile
+import time as timer
+from functools import partial
 import numpy as np
-from ogs5py import OGS, specialrange, generate_time, by_id
-from ogs5py.reader import readpvd
+from ogs5py import OGS, specialrange, generate_time
 import gstools as gs
 from gstools import transform as tf
-from mpi4py import MPI
+from radial_mean import radial_mean_operator
+from vtu_reader import read_pvd_point_data
+from manifest import Manifest, RetryQueue, DONE
+from pipeline import Pipeline
+from field_batch import FieldBatch
+from flow_solver import FlowSolver
+from ens_stats import EnsembleStats
+from ens_store import EnsembleStore
+from telemetry import Telemetry
+from input_writer import InputWriter
+from adaptive import AdaptiveTasks
+from sampling import Sampler, SCHEMES, block_size
+from mlmc import MLMCTasks, interp_matrix
+from scratch import Scratch
 
 
-def angles_mean(time, rad, angles, path):
+def angles_mean(time, rad_op, path, save=True, head=None):
     """Generate mean along angles for single simulation."""
-    # read output from ogs5py
-    out = readpvd(task_root=path, task_id="model", pcs="GROUNDWATER_FLOW")
-    rt_head = np.zeros(time.shape + rad.shape, dtype=float)
-    # loop over time
-    for select, step in enumerate(time):
-        points = out["DATA"][select]["points"]
-        radii = np.sqrt(points[:, 0] ** 2 + points[:, 1] ** 2)
-        rad_ids = np.argmin(np.abs(np.subtract.outer(rad, radii)), axis=0)
-        for i, head in enumerate(out["DATA"][select]["point_data"]["HEAD"]):
-            rt_head[select, rad_ids[i]] += head
-    # only one head value for rad=0
-    rt_head[:, 1:] = rt_head[:, 1:] / angles
-    np.savetxt(os.path.join(path, "rad_mean_head.txt"), rt_head)
-
-
-# rank is the actual core-number, size is total number of cores
-rank = MPI.COMM_WORLD.Get_rank()
-size = MPI.COMM_WORLD.Get_size()
+    if head is None:
+        # nodal heads for all time steps: (node, time) (only HEAD is parsed)
+        head = read_pvd_point_data(path, steps=len(time), name="HEAD")
+    # apply the precomputed averaging operator to all time steps at once
+    rt_head = rad_op.dot(head).T
+    if save:
+        os.makedirs(path, exist_ok=True)
+        np.savetxt(os.path.join(path, "rad_mean_head.txt"), rt_head)
+    return rt_head
+
+
+def task_seed(para_no, seed_no, level=None):
+    """Seed of a single realization (independent of the executing rank)."""
+    entropy = (para_no, seed_no) if level is None else (para_no, seed_no, level)
+    return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+
+def init_model(task_dir, mesh=None):
+    """Initialize the OGS model of the pumping test in the given directory."""
+    # number of angles and radii of the mesh
+    mesh_angles, mesh_rad = (angles, rad) if mesh is None else mesh
+    model = OGS(task_root=task_dir, task_id="model")
+    # generate mesh and gli
+    model.msh.generate("radial", dim=2, angles=mesh_angles, rad=mesh_rad)
+    model.gli.generate(
+        "radial", dim=2, angles=mesh_angles, rad_out=mesh_rad[-1]
+    )
+    # add the pumping well
+    model.gli.add_points(points=[0.0, 0.0, 0.0], names="pwell")
+
+    # --------------generate different ogs input settings-------------------- #
+
+    model.pcs.add_block(  # set the process type
+        PCS_TYPE=pcs_type_flow, NUM_TYPE="NEW"
+    )
+    model.mpd.add(name="transmissivity")
+    model.mpd.add_block(  # edit recent mpd file
+        MSH_TYPE=pcs_type_flow, MMP_TYPE="PERMEABILITY", DIS_TYPE="ELEMENT",
+    )
+    model.mmp.add_block(  # permeability, storage and porosity
+        GEOMETRY_DIMENSION=2,
+        PERMEABILITY_TENSOR=["ISOTROPIC", 1.0],
+        PERMEABILITY_DISTRIBUTION=model.mpd.file_name,
+    )
+    model.bc.add_block(  # set boundary condition
+        PCS_TYPE=pcs_type_flow,
+        PRIMARY_VARIABLE=var_name_flow,
+        GEO_TYPE=["POLYLINE", "boundary"],
+        DIS_TYPE=["CONSTANT", 0.0],
+    )
+    model.ic.add_block(  # set the initial condition
+        PCS_TYPE=pcs_type_flow,
+        PRIMARY_VARIABLE=var_name_flow,
+        GEO_TYPE="DOMAIN",
+        DIS_TYPE=["CONSTANT", 0.0],
+    )
+    model.st.add_block(  # set pumping condition at the pumpingwell
+        PCS_TYPE=pcs_type_flow,
+        PRIMARY_VARIABLE=var_name_flow,
+        GEO_TYPE=["POINT", "pwell"],
+        DIS_TYPE=["CONSTANT_NEUMANN", prate],
+    )
+    model.num.add_block(  # set the parameters for the solver
+        PCS_TYPE=pcs_type_flow,
+        LINEAR_SOLVER=[2, 5, 1.0e-14, 1000, 1.0, 100, 4],
+    )
+    model.tim.add_block(  # set the TIMESTEPS
+        PCS_TYPE=pcs_type_flow, **generate_time(time)
+    )
+    model.out.add_block(  # set the outputformat for the whole domain
+        PCS_TYPE=pcs_type_flow,
+        NOD_VALUES=var_name_flow,
+        GEO_TYPE="DOMAIN",
+        DAT_TYPE="PVD",
+        TIM_TYPE=["STEPS", 1],
+    )
+    model.write_input()
+    return model
+
+
+class Realization:
+    """Run single realizations of the ensemble in a given task directory."""
+
+    def __init__(
+        self,
+        task_dir,
+        store=None,
+        member_output="store",
+        solver="ogs",
+        cross_check=0,
+        telemetry=None,
+        sampling="mc",
+        qmc_block=16,
+        field_memory=None,
+        field_dtype="float64",
+        mesh=None,
+        name="",
+        scratch=None,
+    ):
+        # radii of the angular means (of a coarser mesh for multilevel MC)
+        self.rad = rad if mesh is None else mesh[1]
+        self.model = init_model(task_dir, mesh)
+        # writes only changed input files (and the mpd data in bulk)
+        self.writer = InputWriter(self.model)
+        self.store = store
+        self.member_output = member_output
+        # sub-directory of the outputs in the parameter set directories
+        self.name = name
+        # node-local staging of the OGS output (None: in the results tree)
+        self.scratch = scratch
+        self.member_dir = None
+        # node to radius assignment for the angular means (once per mesh)
+        self.rad_op = radial_mean_operator(self.model.msh.NODES, self.rad)
+        # in-process solver with the same setup as the OGS model
+        self.flow = None
+        if solver == "native":
+            dist = np.linalg.norm(self.model.msh.NODES, axis=1)
+            self.flow = FlowSolver(
+                self.model.msh,
+                time,
+                fixed=np.flatnonzero(np.isclose(dist, rad[-1])),
+                source=np.argmin(dist),
+                rate=prate,
+            )
+        # number of realizations left to cross-check with OGS
+        self.cross_check = cross_check if self.flow is not None else 0
+        self.head = None
+        self.para_no = None
+        self.srf = None
+        self.batch = None
+        self.sampler = None
+        self.sampling = (sampling, qmc_block)
+        # memory budget [bytes] for streamed field generation and its dtype
+        self.field_options = dict(memory=field_memory, dtype=field_dtype)
+        self.rt_head = None
+        # timings and resource usage of the current realization
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.record = None
+
+    def set_para(self, para_no):
+        """Set the parameter set for the following realizations."""
+        if para_no == self.para_no:
+            return
+        para = para_set[para_no]
+        # set storativity
+        self.model.mmp.update_block(STORAGE=[1, para[0]])
+        self.writer.write(self.model.mmp)
+        # init cov model (truncated power law with gaussian modes)
+        cov = gs.TPLGaussian(
+            dim=2, var=para[2], len_scale=para[3], hurst=para[4]
+        )
+        # init spatial random field class
+        self.srf = gs.SRF(
+            cov, mean=np.log(para[1]), upscaling="coarse_graining"
+        )
+        # positions and upscaled variance are fixed for the parameter set
+        self.batch = FieldBatch(
+            self.srf,
+            self.model.msh,
+            point_volumes=self.model.msh.volumes_flat,
+            **self.field_options
+        )
+        # random modes of the realizations (seeds of independent blocks)
+        self.sampler = Sampler(
+            self.batch, partial(task_seed, para_no), *self.sampling
+        )
+        self.para_no = para_no
+
+    def prepare(self, para_no, seed_no, modes=None):
+        """Generate and write the transmissivity field of a realization."""
+        self.record = self.telemetry.record(para=int(para_no), seed=int(seed_no))
+        with self.record.stage("setup"):
+            self.set_para(para_no)
+        model, srf = self.model, self.srf
+        with self.record.stage("field"):
+            # generate new transmissivity field (from given random modes)
+            if modes is None:
+                modes = self.sampler.modes(seed_no)
+            srf.field = self.batch.fields([modes])[0]
+            # transfrom to log-normal field
+            tf.normal_to_lognormal(srf)
+        if self.flow is None or self.cross_check > 0:
+            with self.record.stage("mpd"):
+                # write the transmissivity to the mpd file of the ogs project
+                self.writer.write_mpd(srf.field)
+        # set the new output-directory
+        member = os.path.join(
+            "para{:04}".format(para_no), self.name, "seed{:04}".format(seed_no)
+        )
+        self.member_dir = os.path.join(task_root, member)
+        model.output_dir = self.member_dir
+        if self.scratch is not None:
+            model.output_dir = os.path.join(self.scratch.path, "output", member)
+
+    def solve(self, para_no, seed_no):
+        """Solve the prepared realization. Returns the success."""
+        print("  run model {:04}_{:04}".format(para_no, seed_no), end=" ")
+        with self.record.stage("solve"):
+            if self.flow is None:
+                success = self.model.run_model(
+                    print_log=False, save_log=keep_output
+                )
+            else:
+                self.head = self.flow(self.srf.field, para_set[para_no][0])
+                success = np.all(np.isfinite(self.head))
+        print("  ...success") if success else print("  ...error!")
+        if not success:
+            self.telemetry.write(
+                self.record, success=False, exit_status=self.exit_status()
+            )
+        return bool(success)
+
+    def exit_status(self):
+        """Exit status of the last OGS run (None for the native solver)."""
+        return None if self.flow is not None else self.model.exitstatus
+
+    def output_size(self):
+        """Size of the OGS output of the current realization in bytes."""
+        if self.flow is not None:
+            return 0
+        with os.scandir(self.model.output_dir) as files:
+            return sum(file.stat().st_size for file in files if file.is_file())
+
+    def finish(self, para_no, seed_no):
+        """Calculate the angular means and clean up a solved realization."""
+        model, record = self.model, self.record
+        output_size = self.output_size()
+        head = self.head
+        if self.flow is None:
+            with record.stage("read"):
+                # nodal heads for all time steps (only HEAD is parsed)
+                head = read_pvd_point_data(
+                    model.output_dir, steps=len(time), name="HEAD"
+                )
+        # calculate angular means
+        with record.stage("angles_mean"):
+            self.rt_head = angles_mean(
+                time,
+                self.rad_op,
+                self.member_dir,
+                save=self.member_output == "text",
+                head=head,
+            )
+        if self.cross_check > 0:
+            with record.stage("check"):
+                self.check(para_no, seed_no)
+        if self.store is not None:
+            with record.stage("store"):
+                self.store.write(para_no, seed_no, self.rt_head)
+        # export the generated transmissivity field as vtk
+        if keep_output:
+            with record.stage("export"):
+                os.makedirs(model.output_dir, exist_ok=True)
+                model.msh.export_mesh(
+                    os.path.join(model.output_dir, "field.vtu"),
+                    file_format="vtk",
+                    cell_data_by_id={"transmissivity": self.srf.field},
+                )
+                if self.scratch is not None:
+                    self.scratch.move(model.output_dir, self.member_dir)
+        elif self.flow is None:
+            with record.stage("remove"):
+                self.remove_output()
+        self.telemetry.write(
+            record,
+            success=True,
+            exit_status=self.exit_status(),
+            output_bytes=output_size,
+        )
+        return True
+
+    def check(self, para_no, seed_no):
+        """Cross-check the angular means of the native solver with OGS."""
+        self.cross_check -= 1
+        name = "{:04}_{:04}".format(para_no, seed_no)
+        if not self.model.run_model(print_log=False, save_log=keep_output):
+            print("  cross-check {}: OGS failed".format(name))
+            return
+        ogs_head = angles_mean(time, self.rad_op, self.model.output_dir, False)
+        diff = np.max(np.abs(self.rt_head - ogs_head))
+        print("  cross-check {}: max. deviation from OGS {:.3e}".format(name, diff))
+        if not keep_output:
+            self.remove_output()
+
+    def remove_output(self):
+        """Remove the OGS output of the current realization."""
+        model = self.model
+        if self.scratch is not None:
+            # nothing else in the scratch output (member files are elsewhere)
+            self.scratch.remove(model.output_dir)
+            return
+        files = model.output_files(pcs="GROUNDWATER_FLOW", typ="PVD")
+        files.append("model_GROUNDWATER_FLOW.pvd")
+        for file in files:
+            os.remove(os.path.join(model.output_dir, file))
+        if self.member_output != "text":
+            os.rmdir(model.output_dir)
+
+    def close(self, remove=True):
+        """Close the telemetry and wait for the scratch cleanup."""
+        self.telemetry.close()
+        if self.scratch is not None:
+            self.scratch.close(remove=remove)
+
+    def __call__(self, para_no, seed_no, modes=None):
+        """Run a single realization. Returns the success."""
+        self.prepare(para_no, seed_no, modes)
+        if not self.solve(para_no, seed_no):
+            return False
+        return self.finish(para_no, seed_no)
+
+
+class LevelRun:
+    """
+    Run the coupled samples of the multilevel ensembles.
+
+    A sample on level ``l`` is the realization on the mesh of this level
+    minus (for ``l > 0``) the realization on the mesh of level ``l - 1``,
+    both driven by the same random modes. The angular means are interpolated
+    to the output radii. Returns the success and the sample with its cost.
+
+    Parameters
+    ----------
+    task_dir : :class:`str`
+        Task directory (one sub-directory per level).
+    meshes : :class:`list` of :class:`tuple`
+        Number of angles and radii of the meshes of all levels.
+    solver : :class:`str`, optional
+        Solver of the realizations. Default: ``"ogs"``
+    telemetry : :any:`Telemetry`, optional
+        Telemetry writer. Default: :any:`None`
+    scratch : :any:`Scratch`, optional
+        Node-local staging of the OGS output. Default: :any:`None`
+    **field_options
+        Memory budget and dtype of the field generation
+        (``field_memory``, ``field_dtype``, see :any:`Realization`).
+    """
+
+    def __init__(
+        self,
+        task_dir,
+        meshes,
+        solver="ogs",
+        telemetry=None,
+        scratch=None,
+        **field_options
+    ):
+        self.scratch = scratch
+        self.levels = [
+            Realization(
+                os.path.join(task_dir, "level{}".format(level)),
+                member_output="none",
+                solver=solver,
+                telemetry=telemetry,
+                mesh=mesh,
+                name="level{}".format(level),
+                scratch=scratch,
+                **field_options
+            )
+            for level, mesh in enumerate(meshes)
+        ]
+        self.interp = [interp_matrix(mesh[1], rad).T for mesh in meshes]
+
+    def close(self, remove=True):
+        """Close the telemetry and the scratch (shared by all levels)."""
+        self.levels[-1].close(remove)
+
+    def head(self, level, para_no, seed_no, modes):
+        """Angular mean head on a level at the output radii (None if failed)."""
+        realization = self.levels[level]
+        if not realization(para_no, seed_no, modes):
+            return None
+        return realization.rt_head.dot(self.interp[level])
+
+    def __call__(self, para_no, seed_no, level):
+        """Run a sample and return the success and (sample, wall time)."""
+        start = timer.perf_counter()
+        fine = self.levels[level]
+        fine.set_para(para_no)
+        modes = fine.batch.modes(task_seed(para_no, seed_no, level))
+        value = self.head(level, para_no, seed_no, modes)
+        if value is not None and level > 0:
+            coarse = self.head(level - 1, para_no, seed_no, modes)
+            value = None if coarse is None else value - coarse
+        return value is not None, (value, timer.perf_counter() - start)
+
+
+def mlmc_max_levels(min_angles=4, min_rad=3):
+    """Maximal number of levels keeping enough angles and radii to mesh."""
+    levels = 1
+    while (
+        angles // 2 ** levels >= min_angles and len(rad) // 2 ** levels >= min_rad
+    ):
+        levels += 1
+    return levels
+
+
+def mlmc_meshes(levels):
+    """Meshes of the levels, halving angles and radii per coarser level."""
+    meshes = []
+    for level in range(levels):
+        coarsening = 2 ** (levels - 1 - level)
+        level_rad = specialrange(0, rad[-1], len(rad) // coarsening, typ="cub")
+        meshes.append((angles // coarsening, level_rad))
+    return meshes
+
+
+def save_meta(member_output):
+    """Save time, radii, angles, the parameter sets and the output mode."""
+    os.makedirs(task_root, exist_ok=True)
+    # the comparison reads the members from the output of the last run
+    with open(os.path.join(task_root, "member_output.txt"), "w") as out:
+        out.write(member_output + "\n")
+    np.savetxt(os.path.join(task_root, "time.txt"), time)
+    np.savetxt(os.path.join(task_root, "rad.txt"), rad)
+    np.savetxt(os.path.join(task_root, "angles.txt"), [angles])
+    for para_no, para in enumerate(para_set):
+        para_dir = os.path.join(task_root, "para{:04}".format(para_no))
+        os.makedirs(para_dir, exist_ok=True)
+        np.savetxt(  # save parameter set to file
+            os.path.join(para_dir, "para.txt"),
+            para,
+            header="storage, trans_gmean, var, len_scale, hurst",
+        )
+
+
+def prepare(args, writer):
+    """Save meta data and set up tasks, manifest and statistics on root."""
+    save_meta(args.member_output)
+    if not args.resume:
+        # a fresh run starts without the members of the last run
+        shutil.rmtree(store_dir, ignore_errors=True)
+        for seed_dir in glob.glob(os.path.join(task_root, "para*", "seed*")):
+            shutil.rmtree(seed_dir, ignore_errors=True)
+    store = None
+    if args.member_output == "store":
+        store = EnsembleStore.create(store_dir, time, rad, para_set)
+    # all realizations of all parameter sets (the maximum if adaptive)
+    size = args.max_members if args.adaptive else ens_size
+    tasks = [(p, i) for p in range(len(para_set)) for i in range(size)]
+    manifest = Manifest(manifest_dir, writer)
+    stats = init_stats(args)
+    if not args.resume:
+        manifest.clear()
+        shutil.rmtree(telemetry_dir, ignore_errors=True)
+        # a previous multilevel estimate would be used by the comparison
+        for file in glob.glob(os.path.join(task_root, "para*", "mlmc_levels.txt")):
+            os.remove(file)
+        return adaptive_tasks(args, tasks, stats), manifest, stats
+    # only run missing realizations (ens_size could also be increased)
+    tasks = manifest.pending(tasks, skip_failed=args.skip_failed)
+    if not args.adaptive:
+        print("resume: {} tasks pending".format(len(tasks)))
+    # add completed members from the previous runs to the statistics
+    done = [task for task, state in manifest.states().items() if state == DONE]
+    missing = 0
+    for para_no in range(len(para_set)):
+        seeds = sorted(i for p, i in done if p == para_no and i < size)
+        if store is not None:
+            # the store gives the present members in seed order
+            present = set(store.members(para_no))
+            found = [i for i in seeds if i in present]
+            heads = list(zip(found, store.heads(para_no, found)))
+        else:
+            para_dir = os.path.join(task_root, "para{:04}".format(para_no))
+            files = [
+                os.path.join(para_dir, "seed{:04}".format(i), "rad_mean_head.txt")
+                for i in seeds
+            ]
+            heads = [
+                (i, np.loadtxt(file))
+                for i, file in zip(seeds, files)
+                if os.path.exists(file)
+            ]
+        for seed_no, head in heads:
+            stats.add(para_no, head, seed_no)
+        missing += len(seeds) - len(heads)
+    if missing:
+        print("resume: {} completed members missing in stats".format(missing))
+    return adaptive_tasks(args, tasks, stats, done), manifest, stats
+
+
+def adaptive_tasks(args, tasks, stats, done=()):
+    """
+    Task queue growing the ensembles until the mean head converged.
+
+    Returns the given tasks, if the ensemble size is fixed. The queue
+    monitors its own copy of the mean and variance of the finished members.
+    """
+    if not args.adaptive:
+        return tasks
+    monitor = EnsembleStats(stats.shape, block_size=stats.block_size)
+    monitor.moments = copy.deepcopy(stats.moments)
+    monitor.blocks = copy.deepcopy(stats.blocks)
+    return AdaptiveTasks(
+        range(len(para_set)),
+        monitor,
+        error_window,
+        args.adaptive,
+        min_members=args.min_members,
+        max_members=args.max_members,
+        done=done,
+    )
+
+
+def init_stats(args):
+    """Streaming statistics of the angular mean heads."""
+    sketch = None
+    if args.quantiles:
+        sketch = dict(lower=sketch_range[0], upper=sketch_range[1])
+    return EnsembleStats(
+        (len(time), len(rad)),
+        sketch=sketch,
+        block_size=block_size(args.sampling, args.qmc_block),
+    )
+
+
+def save_stats(args, stats):
+    """Save the statistics and report the variance reduction of the sampling."""
+    stats.save(task_root, args.quantiles)
+    for para_no in sorted(stats.blocks):
+        print(
+            "para {:04}: variance reduction {:.2f} by {} sampling "
+            "({} blocks)".format(
+                para_no,
+                stats.reduction(para_no, error_window),
+                args.sampling,
+                stats.count(para_no),
+            )
+        )
+
+
+def open_store(member_output):
+    """Open the binary ensemble store if used."""
+    return EnsembleStore(store_dir) if member_output == "store" else None
+
+
+def open_telemetry(telemetry, name):
+    """Telemetry writer of a rank (writes nothing if not wanted)."""
+    return Telemetry(telemetry_dir if telemetry else None, name)
+
+
+def field_memory(args):
+    """Memory budget of the field generation in bytes (None if unlimited)."""
+    return int(args.field_memory * 2 ** 20) if args.field_memory > 0 else None
+
+
+def open_scratch(root, name):
+    """Node-local scratch directory of a worker (None if not staged)."""
+    return None if root is None else Scratch(root, name)
+
+
+def pool_scratch(root):
+    """Unique scratch root of the pool workers of a run (None if not staged)."""
+    if root is None:
+        return None
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix="pool_", dir=root)
+
+
+def pool_worker(
+    worker_id,
+    member_output,
+    solver,
+    cross_check,
+    telemetry=False,
+    sampling="mc",
+    qmc_block=16,
+    scratch=None,
+    field_memory=None,
+    field_dtype="float64",
+):
+    """Task runner of a pool worker in its own task directory."""
+    cstr = "core{:04}".format(worker_id)
+    print("write files on core {:02}".format(worker_id))
+    scratch = open_scratch(scratch, cstr)
+    realization = Realization(
+        os.path.join(task_root if scratch is None else scratch.path, cstr),
+        open_store(member_output),
+        member_output,
+        solver,
+        cross_check,
+        open_telemetry(telemetry, cstr),
+        sampling,
+        qmc_block,
+        field_memory,
+        field_dtype,
+        scratch=scratch,
+    )
+
+    def run(para_no, seed_no):
+        """Run a realization and return its angular mean."""
+        success = realization(para_no, seed_no)
+        return success, realization.rt_head
+
+    run.close = partial(realization.close, remove=not keep_output)
+    return run
+
+
+def run_pool(args):
+    """Run the ensemble on a pool of local processes."""
+    from pool import pool_tasks
+
+    tasks, manifest, stats = prepare(args, "master")
+    workers = args.workers or os.cpu_count()
+    scratch = pool_scratch(args.scratch)
+    if args.adaptive:
+        print("run adaptive ensembles on {} local workers".format(workers))
+    else:
+        print("run {} tasks on {} local workers".format(len(tasks), workers))
+
+    def collect(task, rt_head):
+        """Add the angular mean of a realization to the statistics."""
+        stats.add(task[0], rt_head, task[1])
+        if args.adaptive:
+            tasks.collect(task, rt_head)
+
+    fail = pool_tasks(
+        tasks,
+        partial(
+            pool_worker,
+            member_output=args.member_output,
+            solver=args.solver,
+            cross_check=args.cross_check,
+            telemetry=args.telemetry,
+            sampling=args.sampling,
+            qmc_block=args.qmc_block,
+            scratch=scratch,
+            field_memory=field_memory(args),
+            field_dtype=args.field_dtype,
+        ),
+        workers,
+        retries=args.retries,
+        record=manifest.record,
+        collect=collect,
+    )
+    # remove OGS5 settings
+    if not keep_output:
+        for worker_id in range(workers):
+            cstr = "core{:04}".format(worker_id)
+            shutil.rmtree(os.path.join(task_root, cstr), ignore_errors=True)
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    save_stats(args, stats)
+    if args.adaptive:
+        tasks.report()
+    # final success message
+    if fail:
+        print("FAILED:", fail)
+    else:
+        print("SUCCESS")
+
+
+def mlmc_worker(
+    worker_id,
+    levels,
+    solver,
+    telemetry=False,
+    scratch=None,
+    field_memory=None,
+    field_dtype="float64",
+):
+    """Multilevel sample runner of a worker in its own task directory."""
+    cstr = "core{:04}".format(worker_id)
+    print("write files on core {:02}".format(worker_id))
+    scratch = open_scratch(scratch, cstr)
+    return LevelRun(
+        os.path.join(task_root if scratch is None else scratch.path, cstr),
+        mlmc_meshes(levels),
+        solver,
+        open_telemetry(telemetry, cstr),
+        scratch,
+        field_memory=field_memory,
+        field_dtype=field_dtype,
+    )
+
+
+def run_mlmc(args):
+    """Run multilevel Monte Carlo ensembles on the pool or on MPI ranks."""
+    worker = partial(
+        mlmc_worker,
+        levels=args.mlmc,
+        solver=args.solver,
+        telemetry=args.telemetry,
+        field_memory=field_memory(args),
+        field_dtype=args.field_dtype,
+    )
+    tasks = MLMCTasks(
+        range(len(para_set)),
+        args.mlmc,
+        (len(time), len(rad)),
+        error_window,
+        args.adaptive,
+        pilot=args.mlmc_pilot,
+        max_samples=args.max_members,
+    )
+    rank, fail = 0, []
+    if args.backend == "pool":
+        from pool import pool_tasks
+
+        save_meta("mlmc")
+        shutil.rmtree(telemetry_dir, ignore_errors=True)
+        # the estimate is saved per set only, the store would shadow it
+        shutil.rmtree(store_dir, ignore_errors=True)
+        workers = args.workers or os.cpu_count()
+        print("run {} levels on {} local workers".format(args.mlmc, workers))
+        scratch = pool_scratch(args.scratch)
+        fail = pool_tasks(
+            tasks,
+            partial(worker, scratch=scratch),
+            workers,
+            retries=args.retries,
+            collect=tasks.collect,
+        )
+        task_dirs = [
+            os.path.join(task_root, "core{:04}".format(i)) for i in range(workers)
+        ]
+        task_dirs += [] if scratch is None else [scratch]
+    else:
+        from mpi4py import MPI
+        from scheduler import serve_tasks, request_tasks
+
+        comm = MPI.COMM_WORLD
+        rank = comm.Get_rank()
+        if comm.Get_size() < 2:
+            raise ValueError("multilevel ensembles need at least two MPI ranks")
+        if rank == 0:
+            save_meta("mlmc")
+            shutil.rmtree(telemetry_dir, ignore_errors=True)
+            shutil.rmtree(store_dir, ignore_errors=True)
+        comm.barrier()
+        task_dirs = []
+        if rank == 0:
+            print("serve {} levels to {} workers".format(args.mlmc, comm.size - 1))
+            fail = serve_tasks(tasks, retries=args.retries, collect=tasks.collect)
+        else:
+            run, results = worker(rank, scratch=args.scratch), {}
+            task_dirs.append(os.path.join(task_root, "core{:04}".format(rank)))
+
+            def run_task(*task):
+                """Run a sample and keep its result for the master."""
+                success, results[task] = run(*task)
+                return success
+
+            request_tasks(run_task, results=results)
+            run.close(remove=not keep_output)
+    # remove OGS5 settings
+    if not keep_output:
+        for task_dir in task_dirs:
+            shutil.rmtree(task_dir, ignore_errors=True)
+    if rank == 0:
+        tasks.save(task_root)
+        tasks.report()
+        print("FAILED:", fail) if fail else print("SUCCESS")
+
+
+def run_mpi(args):
+    """Run the ensemble on all MPI ranks."""
+    from mpi4py import MPI
+    from scheduler import (
+        static_tasks,
+        serve_tasks,
+        request_tasks,
+    )
+
+    # rank is the actual core-number, size is total number of cores
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    # dynamic scheduling needs a master and at least one worker
+    dynamic = args.scheduler == "dynamic" and size > 1
+    if args.adaptive and not dynamic:
+        raise ValueError("adaptive ensembles need at least two MPI ranks")
+    # save meta info and set up the tasks only on core 0
+    if rank == 0:
+        writer = "master" if dynamic else "core0000"
+        tasks, manifest, stats = prepare(args, writer)
+    else:
+        tasks, stats = None, init_stats(args)
+    # all ranks need to work on the same tasks
+    tasks = comm.bcast(tasks, root=0)
+    store = open_store(args.member_output)
+
+    # collect failed runs
+    fail = []
+    if dynamic and rank == 0:
+        if args.adaptive:
+            print("serve adaptive ensembles to {} workers".format(size - 1))
+        else:
+            print("serve {} tasks to {} workers".format(len(tasks), size - 1))
+        fail = serve_tasks(
+            tasks,
+            retries=args.retries,
+            record=manifest.record,
+            collect=tasks.collect if args.adaptive else None,
+        )
+    else:
+        # generate a model for each core (prevent writing conflicts)
+        cstr = "core{:04}".format(rank)
+        manifest = Manifest(manifest_dir, cstr)
+        print("write files on core {:02}".format(rank))
+        # pipelined: two task directories to prepare the next realization
+        slots = 2 if args.pipeline else 1
+        scratch = open_scratch(args.scratch, cstr)
+        task_base = task_root if scratch is None else scratch.path
+        task_dirs = [os.path.join(task_base, cstr)]
+        task_dirs += [task_dirs[0] + "_{}".format(i) for i in range(1, slots)]
+        telemetry = open_telemetry(args.telemetry, cstr)
+        realizations = [
+            Realization(
+                task_dir,
+                store,
+                args.member_output,
+                args.solver,
+                args.cross_check,
+                telemetry,
+                args.sampling,
+                args.qmc_block,
+                field_memory(args),
+                args.field_dtype,
+                scratch=scratch,
+            )
+            for task_dir in task_dirs
+        ]
+        # angular means sent to the master to monitor the adaptive ensembles
+        results = {}
+
+        def collect(task, realization):
+            """Add the angular mean of a realization to the statistics."""
+            stats.add(task[0], realization.rt_head, task[1])
+            if args.adaptive:
+                results[task] = realization.rt_head
+
+        def run(para_no, seed_no):
+            """Run a realization and add its angular mean to the statistics."""
+            success = realizations[0](para_no, seed_no)
+            if success:
+                collect((para_no, seed_no), realizations[0])
+            return success
+
+        pipeline = Pipeline(realizations, collect) if args.pipeline else None
+        if dynamic:
+            request_tasks(run if pipeline is None else pipeline, results=results)
+        elif pipeline is not None:
+            fail = pipeline.run_tasks(
+                static_tasks(tasks), args.retries, manifest.record
+            )
+        else:
+            queue = RetryQueue(static_tasks(tasks), args.retries, manifest.record)
+            while queue:
+                task = queue.popleft()
+                queue.report(task, run(*task))
+            fail = queue.failed
+        if pipeline is not None:
+            pipeline.close()
+        telemetry.close()
+        # remove OGS5 settings
+        if not keep_output:
+            for task_dir in task_dirs:
+                shutil.rmtree(task_dir)
+        if scratch is not None:
+            scratch.close(remove=not keep_output)
+    # combine the ensemble statistics of all ranks
+    stats = stats.reduce(comm)
+    if rank == 0:
+        save_stats(args, stats)
+        if args.adaptive:
+            tasks.report()
+    # final success message
+    if fail:
+        print("core {:02} FAILED:".format(rank), fail)
+    elif not dynamic or rank == 0:
+        print("core {:02} SUCCESS".format(rank))
+
 
 # state if OGS5 output files should be kept
 keep_output = False
-# size of the ensembles
+# value range for the histograms estimating quantiles of the head
+sketch_range = (-5.0, 0.5)
+# size of the ensembles (maximum size of adaptive ensembles)
 ens_size = 1000
 # pumping rate (1L / s)
 prate = -1e-4
@@ -51,10 +927,12 @@ RES = os.path.join("..", "..", "results")
 task_root = os.path.abspath(os.path.join(RES, "eGRF_TPL_2D"))
 pcs_type_flow = "GROUNDWATER_FLOW"
 var_name_flow = "HEAD"
-
-# generate a model for each core (prevent writing conflicts)
-cstr = "core{:04}".format(rank)
-model = OGS(task_root=os.path.join(task_root, cstr), task_id="model")
+# manifest recording the state of all tasks (one journal per writer)
+manifest_dir = os.path.join(task_root, "manifest")
+# binary (para, seed, time, rad) store of all members
+store_dir = os.path.join(task_root, "store")
+# per-realization timings and resource usage (one JSON lines file per rank)
+telemetry_dir = os.path.join(task_root, "telemetry")
 
 # spatio-temporal configuration
 # define the time stepping: 2 h with 32 steps and increasing stepsize
@@ -63,130 +941,173 @@ time = specialrange(0, 7200, 32, typ="cub")
 rad = specialrange(0, 1000, 100, typ="cub")
 # 64 angles for discretization
 angles = 64
+# window of the ensemble error (compared area in 02_compare_mean.py)
+error_window = np.outer(time > 60, np.logical_and(rad > 0.2, rad < 40))
 
-# generate mesh and gli
-model.msh.generate("radial", dim=2, angles=angles, rad=rad)
-model.gli.generate("radial", dim=2, angles=angles, rad_out=rad[-1])
-# add the pumping well
-model.gli.add_points(points=[0.0, 0.0, 0.0], names="pwell")
-
-# --------------generate different ogs input settings------------------------ #
-
-model.pcs.add_block(  # set the process type
-    PCS_TYPE=pcs_type_flow, NUM_TYPE="NEW"
-)
-model.mpd.add(name="transmissivity")
-model.mpd.add_block(  # edit recent mpd file
-    MSH_TYPE=pcs_type_flow, MMP_TYPE="PERMEABILITY", DIS_TYPE="ELEMENT",
-)
-model.mmp.add_block(  # permeability, storage and porosity
-    GEOMETRY_DIMENSION=2,
-    PERMEABILITY_TENSOR=["ISOTROPIC", 1.0],
-    PERMEABILITY_DISTRIBUTION=model.mpd.file_name,
-)
-model.bc.add_block(  # set boundary condition
-    PCS_TYPE=pcs_type_flow,
-    PRIMARY_VARIABLE=var_name_flow,
-    GEO_TYPE=["POLYLINE", "boundary"],
-    DIS_TYPE=["CONSTANT", 0.0],
-)
-model.ic.add_block(  # set the initial condition
-    PCS_TYPE=pcs_type_flow,
-    PRIMARY_VARIABLE=var_name_flow,
-    GEO_TYPE="DOMAIN",
-    DIS_TYPE=["CONSTANT", 0.0],
-)
-model.st.add_block(  # set pumping condition at the pumpingwell
-    PCS_TYPE=pcs_type_flow,
-    PRIMARY_VARIABLE=var_name_flow,
-    GEO_TYPE=["POINT", "pwell"],
-    DIS_TYPE=["CONSTANT_NEUMANN", prate],
-)
-model.num.add_block(  # set the parameters for the solver
-    PCS_TYPE=pcs_type_flow, LINEAR_SOLVER=[2, 5, 1.0e-14, 1000, 1.0, 100, 4],
-)
-model.tim.add_block(  # set the TIMESTEPS
-    PCS_TYPE=pcs_type_flow, **generate_time(time)
-)
-model.out.add_block(  # set the outputformat for the whole domain
-    PCS_TYPE=pcs_type_flow,
-    NOD_VALUES=var_name_flow,
-    GEO_TYPE="DOMAIN",
-    DAT_TYPE="PVD",
-    TIM_TYPE=["STEPS", 1],
-)
-
-# --------------run OGS simulation------------------------------------------- #
-
-print("write files on core {:02}".format(rank))
-model.write_input()
-
-# save meta info only on core 0
-if rank == 0:
-    np.savetxt(os.path.join(task_root, "time.txt"), time)
-    np.savetxt(os.path.join(task_root, "rad.txt"), rad)
-    np.savetxt(os.path.join(task_root, "angles.txt"), [angles])
-# collect failed runs
-FAIL = []
-# use a rank dependently seeded pseudo-random number generator
-seed = gs.random.MasterRNG(rank)
-for para_no, para in enumerate(para_set):
-    if rank == 0:
-        print("PARA_SET {:04}".format(para_no))
-    # set storativity
-    model.mmp.update_block(STORAGE=[1, para[0]])
-    model.mmp.write_file()
-    # init cov model (truncated power law with gaussian modes)
-    cov = gs.TPLGaussian(dim=2, var=para[2], len_scale=para[3], hurst=para[4])
-    # init spatial random field class
-    srf = gs.SRF(cov, mean=np.log(para[1]), upscaling="coarse_graining")
-    # run the ensemble
-    for i in range(ens_size):
-        # parallel running the right jobs on each core
-        if (para_no * ens_size + i) % size != rank:
-            continue
-        # generate new transmissivity field
-        srf.mesh(model.msh, seed=seed(), point_volumes=model.msh.volumes_flat)
-        # transfrom to log-normal field
-        tf.normal_to_lognormal(srf)
-        # add the transmissivity to the ogs project
-        model.mpd.update_block(DATA=by_id(srf.field))
-        # write the new mpd file
-        model.mpd.write_file()
-        # set the new output-directory
-        model.output_dir = os.path.join(
-            task_root, "para{:04}".format(para_no), "seed{:04}".format(i)
-        )
-        print("  run model {:04}".format(i), end=" ")
-        success = model.run_model(print_log=False, save_log=keep_output)
-        print("  ...success") if success else print("  ...error!")
-        if not success:
-            FAIL.append(str(para_no) + "_" + str(i))
-        # calculate angular means
-        angles_mean(time, rad, angles, model.output_dir)
-        # export the generated transmissivity field as vtk
-        if keep_output:
-            model.msh.export_mesh(
-                os.path.join(model.output_dir, "field.vtu"),
-                file_format="vtk",
-                cell_data_by_id={"transmissivity": srf.field},
-            )
-        else:
-            files = model.output_files(pcs="GROUNDWATER_FLOW", typ="PVD")
-            files.append("model_GROUNDWATER_FLOW.pvd")
-            for file in files:
-                os.remove(os.path.join(model.output_dir, file))
-    if rank == 0:
-        np.savetxt(  # save current parameter set to file
-            os.path.join(task_root, "para{:04}".format(para_no), "para.txt"),
-            para,
-            header="storage, trans_gmean, var, len_scale, hurst",
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backend",
+        choices=["mpi", "pool"],
+        default="mpi",
+        help="mpi: run on all MPI ranks (default), "
+        "pool: run on a pool of local processes (no MPI needed)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="number of local processes for the pool backend "
+        "(default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--scheduler",
+        choices=["dynamic", "static"],
+        default="dynamic",
+        help="dynamic: rank 0 hands out tasks on demand (default), "
+        "static: fixed round-robin assignment of tasks to all ranks",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=0, help="retries for failed runs"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="only run tasks not completed according to the manifest",
+    )
+    parser.add_argument(
+        "--skip-failed",
+        action="store_true",
+        help="don't rerun tasks that failed in a previous run when resuming",
+    )
+    parser.add_argument(
+        "--member-output",
+        choices=["store", "text", "none"],
+        default="store",
+        help="output of the angular mean head of every single realization: "
+        "binary ensemble store (default), text file per member or none",
+    )
+    parser.add_argument(
+        "--quantiles",
+        nargs="*",
+        type=int,
+        default=[],
+        help="percentiles of the heads to estimate by streaming histograms",
+    )
+    parser.add_argument(
+        "--solver",
+        choices=["ogs", "native"],
+        default="ogs",
+        help="ogs: run OGS5 for each realization (default), "
+        "native: in-process finite element solver with the same setup",
+    )
+    parser.add_argument(
+        "--cross-check",
+        type=int,
+        default=0,
+        help="number of realizations per worker to also run with OGS "
+        "to check the native solver",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="overlap field generation and post-processing with the OGS runs "
+        "(two task directories per rank, MPI backend only)",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help="write timings and resource usage of all realizations "
+        "(see 03_telemetry_summary.py)",
+    )
+    parser.add_argument(
+        "--scratch",
+        metavar="DIR",
+        help="stage the task directories and the OGS output of the "
+        "realizations in a node-local directory (e.g. /dev/shm) and clean up "
+        "in the background, only the results are written to the results tree",
+    )
+    parser.add_argument(
+        "--adaptive",
+        type=float,
+        default=0.0,
+        metavar="TOL",
+        help="grow each ensemble until the relative standard error of the "
+        "mean head (max. over the compared window) is below TOL",
+    )
+    parser.add_argument(
+        "--min-members",
+        type=int,
+        default=50,
+        help="minimal ensemble size if adaptive (default: 50)",
+    )
+    parser.add_argument(
+        "--max-members",
+        type=int,
+        default=ens_size,
+        help="maximal ensemble size if adaptive (default: {})".format(ens_size),
+    )
+    parser.add_argument(
+        "--sampling",
+        choices=SCHEMES,
+        default="mc",
+        help="mc: independent fields (default), antithetic: pairs of mirrored "
+        "log-fields, sobol/halton: randomized quasi Monte Carlo of the modes",
+    )
+    parser.add_argument(
+        "--qmc-block",
+        type=int,
+        default=16,
+        help="realizations per scrambled sequence for sobol/halton sampling "
+        "(independent blocks for the error estimate, default: 16)",
+    )
+    parser.add_argument(
+        "--field-memory",
+        type=float,
+        default=0.0,
+        metavar="MB",
+        help="memory budget for the temporaries of the field generation; "
+        "fields are then generated in blocks of elements (bit-identical, "
+        "default: 0 for all elements at once)",
+    )
+    parser.add_argument(
+        "--field-dtype",
+        choices=["float64", "float32"],
+        default="float64",
+        help="data type of the generated fields (default: float64)",
+    )
+    parser.add_argument(
+        "--mlmc",
+        type=int,
+        default=0,
+        metavar="LEVELS",
+        help="multilevel Monte Carlo on LEVELS meshes (halving the angles and "
+        "radii per level) until the rel. std. error is below --adaptive TOL",
+    )
+    parser.add_argument(
+        "--mlmc-pilot",
+        type=int,
+        default=20,
+        help="initial samples per level for multilevel Monte Carlo "
+        "(default: 20)",
+    )
+    args = parser.parse_args()
+    if args.mlmc and not args.adaptive:
+        parser.error("--mlmc needs the target error given by --adaptive TOL")
+    if args.mlmc and (args.pipeline or args.resume or args.sampling != "mc"):
+        parser.error("--mlmc can't be combined with --pipeline, --resume or --sampling")
+    if args.mlmc and not 0 < args.mlmc <= mlmc_max_levels():
+        parser.error(
+            "--mlmc LEVELS needs to be between 1 and {} for {} angles "
+            "and {} radii".format(mlmc_max_levels(), angles, len(rad))
         )
-# remove OGS5 settings
-if not keep_output:
-    shutil.rmtree(os.path.join(task_root, cstr))
-# final success message
-if FAIL:
-    print("core {:02} FAILED:".format(rank), FAIL)
-else:
-    print("core {:02} SUCCESS".format(rank))
+    if args.pipeline and args.backend == "pool":
+        parser.error("--pipeline is only available for the MPI backend")
+    if args.adaptive and args.backend == "mpi" and args.scheduler == "static":
+        parser.error("--adaptive needs the dynamic scheduler or the pool backend")
+    if args.mlmc:
+        run_mlmc(args)
+    elif args.backend == "pool":
+        run_pool(args)
+    else:
+        run_mpi(args)
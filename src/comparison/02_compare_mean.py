@@ -1,20 +1,68 @@
 """Post processing the TPL ensembles."""
 import os
+import sys
 import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.pyplot as plt
-from matplotlib import cm, rc
-import anaflow as ana
-from PyPDF2 import PdfFileMerger
+from ens_store import EnsembleStore
+
+# shared modules of the workflow
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from head_cache import ext_theis_tpl_sweep
 
 
-rc("text", usetex=True)
 CWD = os.path.abspath(os.path.join("..", "..", "results"))
 
 
+def load_store(base="eGRF_TPL_2D"):
+    """Open the binary ensemble store, if used by the last simulation run."""
+    mode_file = os.path.join(CWD, base, "member_output.txt")
+    if os.path.exists(mode_file):
+        with open(mode_file) as mode:
+            if mode.read().strip() != "store":
+                return None
+    path = os.path.join(CWD, base, "store")
+    if os.path.exists(os.path.join(path, "meta.npz")):
+        return EnsembleStore(path)
+    return None
+
+
+def ensemble_means(base="eGRF_TPL_2D", p_min=0, p_max=np.inf):
+    """Time, radii and a generator of the parameter sets with mean heads."""
+    path = os.path.join(CWD, base)
+    store = load_store(base)
+    if store is not None:
+        time, rad = store.time, store.rad
+        para_sets = list(enumerate(store.para_set))
+    else:
+        time = np.loadtxt(os.path.join(path, "time.txt"))
+        rad = np.loadtxt(os.path.join(path, "rad.txt"))
+        para_sets = list(
+            enumerate(sorted(glob.glob(os.path.join(path, "para*"))))
+        )
+
+    def means():
+        """Load the parameters and mean heads of the selected sets."""
+        for para_no, para_set in para_sets:
+            if para_no < p_min or para_no > p_max:
+                continue
+            if store is not None:
+                # plain array reduction on the memory-mapped store
+                yield para_no, para_set, store.mean(para_no)
+            else:
+                para = np.loadtxt(os.path.join(para_set, "para.txt"))
+                mean_file = os.path.join(para_set, "rad_mean_head.txt")
+                yield para_no, para, np.loadtxt(mean_file)
+
+    return time, rad, means()
+
+
 def calc_ensemble_mean(base="eGRF_TPL_2D", p_min=0, p_max=np.inf):
     """Generate mean for all simulations in ensemble from single means."""
+    if load_store(base) is not None:
+        print("ensemble means are reduced from the binary store")
+        return
     para_sets = sorted(glob.glob(os.path.join(CWD, base, "para*")))
     time = np.loadtxt(os.path.join(CWD, base, "time.txt"))
     rad = np.loadtxt(os.path.join(CWD, base, "rad.txt"))
@@ -22,8 +70,18 @@ def calc_ensemble_mean(base="eGRF_TPL_2D", p_min=0, p_max=np.inf):
     for para_no, para_set in enumerate(para_sets):
         if para_no < p_min or para_no > p_max:
             continue
-        print(para_no, "PARA_SET: ensemble mean calculation")
+        # multilevel estimate (no single members of the finest level)
+        if os.path.exists(os.path.join(para_set, "mlmc_levels.txt")):
+            print(para_no, "PARA_SET: using multilevel ensemble mean")
+            continue
         ensemble = sorted(glob.glob(os.path.join(para_set, "seed*")))
+        # skip if the streamed statistics of the run cover all members
+        count_file = os.path.join(para_set, "ens_count.txt")
+        if os.path.exists(count_file):
+            if np.loadtxt(count_file) >= len(ensemble):
+                print(para_no, "PARA_SET: using streamed ensemble mean")
+                continue
+        print(para_no, "PARA_SET: ensemble mean calculation")
         rt_head = np.zeros(time.shape + rad.shape, dtype=float)
         # collect all ensemble members
         for cnt, single in enumerate(ensemble, start=1):
@@ -38,145 +96,278 @@ def calc_ensemble_mean(base="eGRF_TPL_2D", p_min=0, p_max=np.inf):
             np.savetxt(os.path.join(para_set, "rad_mean_head.txt"), rt_head)
 
 
-def compare(base="eGRF_TPL_2D", p_min=0, p_max=np.inf):
-    """Compare ensemble mean to effective drawdown solution."""
+def compare(
+    base="eGRF_TPL_2D", p_min=0, p_max=np.inf, workers=1, plots=True, **style
+):
+    """
+    Compare ensemble mean to effective drawdown solution.
+
+    The maximal relative differences are written to ``diff_summary.csv``.
+    With ``plots``, the comparison plots are rendered by ``workers``
+    processes and merged into ``diff.pdf``. The ``style`` keywords
+    (``fmt``, ``usetex``, ``rasterized``) are passed to :any:`plot_diff`.
+    """
     path = os.path.join(CWD, base)
-    para_sets = sorted(glob.glob(os.path.join(path, "para*")))
-    time = np.loadtxt(os.path.join(path, "time.txt"))
-    rad = np.loadtxt(os.path.join(path, "rad.txt"))
+    time, rad, means = ensemble_means(base, p_min, p_max)
     time_range = time > 60
     rad_range = np.logical_and(rad > 0.2, rad < 40)
     time_select = time[time_range]
     rad_select = rad[rad_range]
-    # iterate over all parameter sets
-    for para_no, para_set in enumerate(para_sets):
-        if para_no < p_min or para_no > p_max:
-            continue
-        para = np.loadtxt(os.path.join(para_set, "para.txt"))
-        rt_head = np.loadtxt(os.path.join(para_set, "rad_mean_head.txt"))
-        print(para_no, "PARA_SET")
-        rt_head = rt_head[time_range]
-        rt_head = rt_head[:, rad_range]
-        et_head = ana.ext_theis_tpl(  # effective transmissivity
+    means = list(means)
+    et_heads = []
+    if means:
+        paras = np.array([para for __, para, __ in means])
+        # effective heads of all parameter sets at once (cached)
+        et_heads = ext_theis_tpl_sweep(
             time=time_select,
             rad=rad_select,
-            storage=para[0],
-            cond_gmean=para[1],
-            var=para[2],
-            len_scale=para[3],
-            hurst=para[4],
+            storage=paras[:, 0],
+            cond_gmean=paras[:, 1],
+            var=paras[:, 2],
+            len_scale=paras[:, 3],
+            hurst=paras[:, 4],
             rate=-1e-4,
             parts=30,
             # gaussian covmodel in GSTools normalized to integral scale
             prop=np.sqrt(np.pi * 2),
         )
+    summary = []
+    report = Report(path, workers, **style) if plots else None
+    # iterate over all parameter sets
+    for (para_no, para, rt_head), et_head in zip(means, et_heads):
+        print(para_no, "PARA_SET")
+        rt_head = rt_head[time_range]
+        rt_head = rt_head[:, rad_range]
         # print relative errors
         abs_diff = np.abs(rt_head - et_head)
         abs_mean = 0.5 * (np.abs(rt_head) + np.abs(et_head))
         rel_diff = abs_diff / np.max(abs_mean)
         print("  max rel. diff:", np.max(rel_diff))
+        summary.append(np.concatenate(([para_no], para, [np.max(rel_diff)])))
         # creat plots
-        plot_diff(
-            time_select, rad_select, rt_head, et_head, para_no, path, para
-        )
+        if report is not None:
+            report.add(time_select, rad_select, rt_head, et_head, para_no, para)
+    # machine readable summary of the relative errors
+    np.savetxt(
+        os.path.join(path, "diff_summary.csv"),
+        np.array(summary).reshape(-1, 7),
+        fmt=["%d"] + 6 * ["%.8e"],
+        delimiter=",",
+        header="para_no,storage,cond_gmean,var,len_scale,hurst,max_rel_diff",
+        comments="",
+    )
     # merge pdfs
-    pdfs = sorted(glob.glob(os.path.join(path, "*_diff.pdf")))
-    merger = PdfFileMerger()
-    for pdf in pdfs:
-        merger.append(pdf)
-    merger.write(os.path.join(path, "diff.pdf"))
-    # for pdf in pdfs:
-    #     os.remove(pdf)
+    if report is not None:
+        report.close()
+
+
+class Report:
+    """
+    Render the comparison plots in parallel and merge them as they arrive.
+
+    The plots are rendered by a pool of processes. Finished plots are
+    appended to the merged ``diff.pdf`` in the order of the parameter sets,
+    as soon as all previous ones are finished (PNG files are not merged).
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Output directory of the plots.
+    workers : :class:`int`, optional
+        Number of processes. If ``1``, the plots are rendered serially.
+        Default: ``1``
+    **style
+        Keyword arguments for :any:`plot_diff` (``fmt``, ``usetex``,
+        ``rasterized``).
+    """
+
+    def __init__(self, path, workers=1, **style):
+        self.path = path
+        self.style = style
+        self.merger = None
+        if style.get("fmt", "pdf") == "pdf":
+            from PyPDF2 import PdfFileMerger
+
+            self.merger = PdfFileMerger()
+        self.plots = []
+        self.pool = ProcessPoolExecutor(workers) if workers > 1 else None
+
+    def add(self, *args):
+        """Render the plot of a parameter set (``plot_diff`` arguments)."""
+        args = args[:5] + (self.path,) + args[5:]
+        if self.pool is None:
+            self.plots.append(plot_diff(*args, **self.style))
+        else:
+            self.plots.append(self.pool.submit(plot_diff, *args, **self.style))
+        self.merge()
+
+    def merge(self, wait=False):
+        """Append the finished plots in order to the merged report."""
+        while self.plots:
+            plot = self.plots[0]
+            if not isinstance(plot, str):
+                if not (wait or plot.done()):
+                    break
+                plot = plot.result()
+            if self.merger is not None:
+                self.merger.append(plot)
+            self.plots.pop(0)
+
+    def close(self):
+        """Wait for all plots and write the merged report."""
+        self.merge(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.merger is not None:
+            self.merger.write(os.path.join(self.path, "diff.pdf"))
+
+
+# figure templates of this process (by text and surface rendering)
+_FIGURES = {}
+
 
+class DiffFigure:
+    """
+    Figure template for the comparison plots of the parameter sets.
 
-def plot_diff(time, rad, rt_head, et_head, para_no, path, para):
+    The figure with the axes, their labels and limits is created once.
+    For each parameter set, only the surfaces and the title are replaced.
+
+    Parameters
+    ----------
+    usetex : :class:`bool`, optional
+        Render the text with LaTeX, otherwise with the (much faster)
+        mathtext of matplotlib. Default: ``True``
+    rasterized : :class:`bool`, optional
+        Rasterize the surfaces, while the text stays vector graphics.
+        Default: ``False``
+    """
+
+    def __init__(self, usetex=True, rasterized=False):
+        from mpl_toolkits.mplot3d import Axes3D
+        import matplotlib.pyplot as plt
+        from matplotlib import rc
+
+        rc("text", usetex=usetex)
+        self.rasterized = rasterized
+        self.fig = plt.figure(figsize=[10, 3.4])
+        self.axes = [
+            plt.subplot2grid((1, 3), loc, fig=self.fig, projection=Axes3D.name)
+            for loc in [(0, 0), (0, 2), (0, 1)]
+        ]
+        titles = [
+            r"Ensemble mean drawdown in $\mathrm{[m]}$",
+            r"Effective drawdown in $\mathrm{[m]}$",
+            r"Absolute difference in $\mathrm{[m]}$",
+        ]
+        z_lims = [(-2.1, 0.1), (-2.1, 0.1), (-1, 1)]
+        for ax, title, z_lim in zip(self.axes, titles, z_lims):
+            ax.view_init(elev=15, azim=-150)
+            ax.set_title(title, pad=-5)
+            ax.set_xlabel(r"$r$ in $\mathrm{[m]}$")
+            ax.set_ylabel(r"$t$ in $\mathrm{[s]}$")
+            ax.set_zlim(z_lim)
+        self.title = self.fig.suptitle("")
+        self.surfaces = []
+        self.layout = False
+
+    def plot(self, time, rad, rt_head, et_head, para_no, para, file, dpi=300):
+        """Plot the comparison of a parameter set and save it to a file."""
+        from matplotlib import cm
+
+        for surface in self.surfaces:
+            surface.remove()
+        time_m, rad_m = np.meshgrid(time, rad, indexing="ij")
+        diff = np.abs(rt_head - et_head)
+        style = dict(
+            rstride=1, cstride=1, antialiased=True, rasterized=self.rasterized
+        )
+        edges = dict(linewidth=0.3, edgecolors="k", **style)
+        ax0, ax1, ax2 = self.axes
+        self.surfaces = [
+            ax0.plot_surface(rad_m, time_m, rt_head, cmap=cm.RdBu, **edges),
+            ax1.plot_surface(rad_m, time_m, et_head, cmap=cm.RdBu, **edges),
+            ax2.plot_surface(
+                rad_m, time_m, diff, cmap=cm.RdBu_r, vmin=0, vmax=1, **edges
+            ),
+            ax2.plot_surface(
+                rad_m, time_m, np.zeros_like(diff), color="k", alpha=0.4, **style
+            ),
+        ]
+        self.title.set_text(
+            r"Parameter set P{}: ".format(para_no)
+            + r"$S={:.1e}".format(para[0])
+            + r"$, $T_G={:.1e}".format(para[1])
+            + r"$, $\sigma^2={}".format(para[2])
+            + r"$, $\ell={}".format(para[3])
+            + r"$, $H={}".format(para[4])
+            + r"$"
+        )
+        # the layout is the same for all parameter sets
+        if not self.layout:
+            self.fig.tight_layout()
+            self.layout = True
+        self.fig.savefig(file, dpi=dpi)
+
+
+def plot_diff(
+    time,
+    rad,
+    rt_head,
+    et_head,
+    para_no,
+    path,
+    para,
+    fmt="pdf",
+    usetex=True,
+    rasterized=False,
+):
     """Plot the comparisson between effective head and ensemble mean."""
-    plt.close("all")
-    fig = plt.figure(figsize=[10, 3.4])
-    ax0 = plt.subplot2grid((1, 3), (0, 0), fig=fig, projection=Axes3D.name)
-    ax1 = plt.subplot2grid((1, 3), (0, 2), fig=fig, projection=Axes3D.name)
-    ax2 = plt.subplot2grid((1, 3), (0, 1), fig=fig, projection=Axes3D.name)
-
-    time_m, rad_m = np.meshgrid(time, rad, indexing="ij")
-    diff = np.abs(rt_head - et_head)
-    z_max = 0.1
-    z_min = -2.1
-
-    ax0.plot_surface(
-        rad_m,
-        time_m,
-        rt_head,
-        rstride=1,
-        cstride=1,
-        cmap=cm.RdBu,
-        linewidth=0.3,
-        antialiased=True,
-        edgecolors="k",
+    key = (usetex, rasterized)
+    if key not in _FIGURES:
+        _FIGURES[key] = DiffFigure(usetex, rasterized)
+    file = os.path.join(path, "{:04}_diff.{}".format(para_no, fmt))
+    # raster graphics only need a moderate resolution for a quick look
+    dpi = 150 if fmt == "png" or rasterized else 300
+    _FIGURES[key].plot(time, rad, rt_head, et_head, para_no, para, file, dpi)
+    return file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes rendering the comparison plots",
+    )
+    parser.add_argument(
+        "--no-plots",
+        action="store_true",
+        help="only write the summary of the relative differences",
     )
-    ax1.plot_surface(
-        rad_m,
-        time_m,
-        et_head,
-        rstride=1,
-        cstride=1,
-        cmap=cm.RdBu,
-        linewidth=0.3,
-        antialiased=True,
-        edgecolors="k",
+    parser.add_argument(
+        "--format",
+        choices=["pdf", "png"],
+        default="pdf",
+        help="file format of the comparison plots (PNG files are not merged)",
     )
-    ax2.plot_surface(
-        rad_m,
-        time_m,
-        diff,
-        rstride=1,
-        cstride=1,
-        cmap=cm.RdBu_r,
-        linewidth=0.3,
-        antialiased=True,
-        edgecolors="k",
-        vmin=0, vmax=1,
+    parser.add_argument(
+        "--mathtext",
+        action="store_true",
+        help="render the text with mathtext instead of LaTeX (faster)",
     )
-    ax2.plot_surface(
-        rad_m,
-        time_m,
-        np.zeros_like(diff),
-        rstride=1,
-        cstride=1,
-        color="k",
-        alpha=0.4,
-        antialiased=True,
+    parser.add_argument(
+        "--rasterize",
+        action="store_true",
+        help="rasterize the surfaces in the PDF plots",
     )
-    ax0.view_init(elev=15, azim=-150)
-    ax1.view_init(elev=15, azim=-150)
-    ax2.view_init(elev=15, azim=-150)
-    fig.suptitle(
-        r"Parameter set P{}: ".format(para_no)
-        + r"$S={:.1e}".format(para[0])
-        + r"$, $T_G={:.1e}".format(para[1])
-        + r"$, $\sigma^2={}".format(para[2])
-        + r"$, $\ell={}".format(para[3])
-        + r"$, $H={}".format(para[4])
-        + r"$"
+    args = parser.parse_args()
+    calc_ensemble_mean()
+    compare(
+        workers=args.workers,
+        plots=not args.no_plots,
+        fmt=args.format,
+        usetex=not args.mathtext,
+        rasterized=args.rasterize,
     )
-    xlab = r"$r$ in $\mathrm{[m]}$"
-    ylab = r"$t$ in $\mathrm{[s]}$"
-    ax0.set_title("Ensemble mean drawdown in $\mathrm{[m]}$", pad=-5)
-    ax1.set_title("Effective drawdown in $\mathrm{[m]}$", pad=-5)
-    ax2.set_title("Absolute difference in $\mathrm{[m]}$", pad=-5)
-    # change axes labels
-    ax0.set_xlabel(xlab)
-    ax0.set_ylabel(ylab)
-    ax1.set_xlabel(xlab)
-    ax1.set_ylabel(ylab)
-    ax2.set_xlabel(xlab)
-    ax2.set_ylabel(ylab)
-    ax0.set_zlim((z_min, z_max))
-    ax1.set_zlim((z_min, z_max))
-    ax2.set_zlim((-1, 1))
-    fig.tight_layout()
-    plt.savefig(os.path.join(path, "{:04}_diff.pdf".format(para_no)), dpi=300)
-    plt.close("all")
-
-
-calc_ensemble_mean()
-compare()
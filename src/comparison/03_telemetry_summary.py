@@ -0,0 +1,249 @@
+"""Summarize the telemetry of the ensemble runs (per stage and per rank)."""
+import os
+import glob
+import json
+import argparse
+from collections import Counter
+import numpy as np
+
+CWD = os.path.abspath(os.path.join("..", "..", "results"))
+
+
+def load_records(path):
+    """Load the telemetry records of all ranks."""
+    records, skipped = [], 0
+    for file in sorted(glob.glob(os.path.join(path, "*.jsonl"))):
+        with open(file) as lines:
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:  # line cut off by a killed job
+                    skipped += 1
+    if skipped:
+        print("skipped {} incomplete telemetry records".format(skipped))
+    return records
+
+
+def stage_summary(records):
+    """Statistics of the wall time and I/O of all stages."""
+    stages = {}
+    for record in records:
+        for name, stage in record["stages"].items():
+            stages.setdefault(name, []).append(
+                (stage["time"], stage["read"], stage["written"])
+            )
+    total = sum(record["wall"] for record in records)
+    summary = {}
+    for name, values in stages.items():
+        times, read, written = np.array(values).T
+        summary[name] = {
+            "count": len(times),
+            "total": times.sum(),
+            "share": times.sum() / total if total > 0 else 0.0,
+            "mean": times.mean(),
+            "median": np.median(times),
+            "p95": np.percentile(times, 95),
+            "max": times.max(),
+            "read_mb": read.sum() / 1e6,
+            "written_mb": written.sum() / 1e6,
+        }
+    return summary
+
+
+def rank_summary(records):
+    """
+    Utilization of all ranks over the span of the whole run.
+
+    The busy time of a rank is the sum of the stage times of its
+    realizations. With ``--pipeline``, stages of two realizations overlap
+    and the utilization can exceed 100%.
+    """
+    start = min(record["start"] for record in records)
+    end = max(record["start"] + record["wall"] for record in records)
+    span = end - start
+    ranks = {}
+    for record in records:
+        ranks.setdefault(record["rank"], []).append(record)
+    summary = {}
+    for rank, rank_records in sorted(ranks.items()):
+        walls = np.array([record["wall"] for record in rank_records])
+        busy = sum(
+            stage["time"]
+            for record in rank_records
+            for stage in record["stages"].values()
+        )
+        summary[rank] = {
+            "host": rank_records[0]["host"],
+            "realizations": len(rank_records),
+            "failed": sum(not record["success"] for record in rank_records),
+            "busy": busy,
+            "utilization": busy / span if span > 0 else 1.0,
+            "mean_wall": walls.mean(),
+            "peak_rss_mb": max(record["peak_rss"] for record in rank_records),
+            "peak_rss_children_mb": max(
+                record["peak_rss_children"] for record in rank_records
+            ),
+        }
+    return summary, span
+
+
+def stragglers(records, count=10, factor=2.0):
+    """Slowest realizations taking longer than ``factor`` times the median."""
+    median = np.median([record["wall"] for record in records])
+    slow = [record for record in records if record["wall"] > factor * median]
+    slow = sorted(slow, key=lambda record: record["wall"], reverse=True)
+    result = []
+    for record in slow[:count]:
+        stage = max(record["stages"], key=lambda s: record["stages"][s]["time"])
+        result.append(
+            {
+                "para": record["para"],
+                "seed": record["seed"],
+                "rank": record["rank"],
+                "wall": record["wall"],
+                "slowest_stage": stage,
+                "stage_time": record["stages"][stage]["time"],
+            }
+        )
+    return result, median
+
+
+def histogram(values, bins=10):
+    """Text histogram of the values (logarithmic bins for wide ranges)."""
+    values = np.asarray(values)
+    low, high = values.min(), values.max()
+    if low > 0 and high > 10 * low:
+        edges = np.geomspace(low, high, bins + 1)
+    else:
+        edges = np.linspace(low, high if high > low else low + 1e-9, bins + 1)
+    counts, edges = np.histogram(values, edges)
+    width = 40 / max(counts.max(), 1)
+    return [
+        "    {:10.4f} - {:10.4f} s | {:<40} {}".format(
+            lo, hi, "#" * int(round(cnt * width)), cnt
+        )
+        for lo, hi, cnt in zip(edges[:-1], edges[1:], counts)
+    ]
+
+
+def summarize(path, hist=True, plot=False):
+    """Print the telemetry summary and save it as JSON."""
+    records = load_records(path)
+    if not records:
+        print("no telemetry found in", path)
+        return None
+    stages = stage_summary(records)
+    ranks, span = rank_summary(records)
+    slow, median = stragglers(records)
+    exit_status = Counter(str(record["exit_status"]) for record in records)
+    print(
+        "{} realizations in {:.1f} s (median {:.3f} s per realization)".format(
+            len(records), span, median
+        )
+    )
+    print("OGS exit status:", dict(exit_status))
+    print(
+        "\nstage          count   total[s]  share   mean[s] median[s]"
+        "    p95[s]    max[s]  read[MB] written[MB]"
+    )
+    for name, stg in sorted(stages.items(), key=lambda s: -s[1]["total"]):
+        print(
+            "{:12} {:7d} {:10.2f} {:5.1%} {:9.4f} {:9.4f} {:9.4f} {:9.4f} "
+            "{:9.2f} {:11.2f}".format(
+                name,
+                stg["count"],
+                stg["total"],
+                stg["share"],
+                stg["mean"],
+                stg["median"],
+                stg["p95"],
+                stg["max"],
+                stg["read_mb"],
+                stg["written_mb"],
+            )
+        )
+    print(
+        "\nrank         host             done failed   busy[s]  util."
+        "  mean[s]  RSS[MB]  OGS RSS[MB]"
+    )
+    for rank, rnk in ranks.items():
+        print(
+            "{:12} {:15} {:5d} {:6d} {:9.1f} {:6.1%} {:8.3f} {:8.1f} {:12.1f}".format(
+                rank,
+                rnk["host"][:15],
+                rnk["realizations"],
+                rnk["failed"],
+                rnk["busy"],
+                rnk["utilization"],
+                rnk["mean_wall"],
+                rnk["peak_rss_mb"],
+                rnk["peak_rss_children_mb"],
+            )
+        )
+    if slow:
+        print("\nstragglers (more than twice the median time):")
+        for rec in slow:
+            print(
+                "  para {:04} seed {:04} on {}: {:.3f} s ({} {:.3f} s)".format(
+                    rec["para"],
+                    rec["seed"],
+                    rec["rank"],
+                    rec["wall"],
+                    rec["slowest_stage"],
+                    rec["stage_time"],
+                )
+            )
+    if hist:
+        print("\nhistograms of the stage times:")
+        for name in stages:
+            print("  " + name)
+            times = [r["stages"][name]["time"] for r in records if name in r["stages"]]
+            print("\n".join(histogram(times)))
+    summary = {
+        "realizations": len(records),
+        "span": span,
+        "median_wall": median,
+        "exit_status": dict(exit_status),
+        "stages": stages,
+        "ranks": ranks,
+        "stragglers": slow,
+    }
+    with open(os.path.join(path, "summary.json"), "w") as out:
+        json.dump(summary, out, indent=2, default=float)
+    if plot:
+        plot_stages(records, stages, path)
+    return summary
+
+
+def plot_stages(records, stages, path):
+    """Plot histograms of the stage times."""
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, len(stages), figsize=[3 * len(stages), 3])
+    for ax, name in zip(np.atleast_1d(axes), stages):
+        times = [r["stages"][name]["time"] for r in records if name in r["stages"]]
+        ax.hist(times, bins=20)
+        ax.set_title(name)
+        ax.set_xlabel("time in [s]")
+    fig.tight_layout()
+    fig.savefig(os.path.join(path, "stages.pdf"))
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        default=os.path.join(CWD, "eGRF_TPL_2D", "telemetry"),
+        help="directory of the telemetry files",
+    )
+    parser.add_argument(
+        "--no-hist", action="store_true", help="don't print the histograms"
+    )
+    parser.add_argument(
+        "--plot", action="store_true", help="plot the stage histograms"
+    )
+    args = parser.parse_args()
+    summarize(args.path, hist=not args.no_hist, plot=args.plot)
@@ -0,0 +1,132 @@
+"""Adaptive ensemble sizes driven by the Monte Carlo error of the mean."""
+from collections import deque
+import numpy as np
+
+
+class AdaptiveTasks:
+    """
+    Queue of ensemble tasks growing each ensemble until its mean converged.
+
+    Tasks ``(para_no, seed_no)`` are handed out parameter set by parameter
+    set (so workers rarely need to set up a new parameter set). A parameter
+    set is stopped, when the relative standard error of its ensemble mean
+    ``max(std_err) / max(|mean|)`` within the given ``(time, rad)`` window
+    drops below the tolerance with at least ``min_members`` members, or when
+    ``max_members`` members were handed out. Since the error is only known
+    for finished members, up to the number of running tasks are handed out
+    in addition.
+
+    The queue can be used in place of a :class:`collections.deque` of tasks
+    in :any:`pool_tasks` and :any:`serve_tasks`. Failed tasks put back by
+    ``append`` are handed out first.
+
+    Parameters
+    ----------
+    para_nos : :class:`list` of :class:`int`
+        Parameter sets of the ensemble.
+    stats : :any:`EnsembleStats`
+        Statistics of the finished members, updated by :any:`collect`.
+    window : :class:`numpy.ndarray`
+        Boolean mask of shape ``(time, rad)`` for the error estimation.
+    tol : :class:`float`
+        Tolerance for the relative standard error of the mean.
+    min_members : :class:`int`, optional
+        Minimal ensemble size. Default: ``50``
+    max_members : :class:`int`, optional
+        Maximal ensemble size. Default: ``1000``
+    done : :class:`list`, optional
+        Tasks finished in previous runs (already in ``stats``).
+        Their seeds are skipped. Default: ``()``
+    """
+
+    def __init__(
+        self,
+        para_nos,
+        stats,
+        window,
+        tol,
+        min_members=50,
+        max_members=1000,
+        done=(),
+    ):
+        self.stats = stats
+        self.window = np.asarray(window, dtype=bool)
+        self.tol = float(tol)
+        self.min_members = int(min_members)
+        self.max_members = int(max_members)
+        self.done = set(done)
+        self.next_seed = {para_no: 0 for para_no in para_nos}
+        self.active = sorted(para_nos)
+        self.retry = deque()
+        for para_no in para_nos:
+            self.check(para_no)
+
+    def count(self, para_no):
+        """Number of finished members of a parameter set."""
+        mom = self.stats.moments.get(para_no)
+        return 0 if mom is None else mom.count
+
+    def error(self, para_no):
+        """Relative standard error of the ensemble mean in the window."""
+        # independent samples (complete blocks for variance-reduced sampling)
+        if self.stats.count(para_no) < 2:
+            return np.inf
+        scale = np.max(np.abs(self.stats.moments[para_no].mean[self.window]))
+        if not scale > 0:
+            return np.inf
+        return np.max(self.stats.std_err(para_no)[self.window]) / scale
+
+    def check(self, para_no):
+        """Stop handing out tasks of a converged parameter set."""
+        if para_no not in self.active or self.count(para_no) < self.min_members:
+            return
+        error = self.error(para_no)
+        if error <= self.tol:
+            print(
+                "para {:04} converged: {} members, rel. std. err. {:.2e}".format(
+                    para_no, self.count(para_no), error
+                )
+            )
+            self.active.remove(para_no)
+
+    def collect(self, task, value):
+        """Add the result of a finished task to the statistics."""
+        self.stats.add(task[0], value, task[1])
+        self.check(task[0])
+
+    def current(self):
+        """Parameter set of the next new task (None if all are stopped)."""
+        while self.active:
+            para_no = self.active[0]
+            while (para_no, self.next_seed[para_no]) in self.done:
+                self.next_seed[para_no] += 1
+            if self.next_seed[para_no] < self.max_members:
+                return para_no
+            self.active.pop(0)
+        return None
+
+    def popleft(self):
+        """Next task to run."""
+        if self.retry:
+            return self.retry.popleft()
+        para_no = self.current()
+        if para_no is None:
+            raise IndexError("pop from an empty queue")
+        self.next_seed[para_no] += 1
+        return para_no, self.next_seed[para_no] - 1
+
+    def append(self, task):
+        """Put back a failed task."""
+        self.retry.append(task)
+
+    def __bool__(self):
+        return bool(self.retry) or self.current() is not None
+
+    def report(self):
+        """Print ensemble size and error of all parameter sets."""
+        for para_no in sorted(self.next_seed):
+            print(
+                "para {:04}: {:5d} members, rel. std. err. {:.2e}".format(
+                    para_no, self.count(para_no), self.error(para_no)
+                )
+            )
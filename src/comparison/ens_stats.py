@@ -0,0 +1,247 @@
+"""Streaming ensemble statistics that can be merged over MPI ranks."""
+import os
+import numpy as np
+
+
+class Welford:
+    """
+    Running mean and variance of equally shaped arrays.
+
+    Members are added one by one by Welford's algorithm, partial results
+    are merged by the parallel update of Chan et al.
+
+    Parameters
+    ----------
+    shape : :class:`tuple`
+        Shape of the ensemble members.
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=float)
+        self.m2 = np.zeros(shape, dtype=float)
+
+    def add(self, value):
+        """Add a single member."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Merge the statistics of another (disjoint) ensemble."""
+        count = self.count + other.count
+        if other.count == 0 or count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def var(self):
+        """Sample variance of the members."""
+        return self.m2 / max(self.count - 1, 1)
+
+    @property
+    def std_err(self):
+        """Standard error of the mean."""
+        return np.sqrt(self.var / max(self.count, 1))
+
+
+class HistSketch:
+    """
+    Mergeable fixed-bin histogram to estimate quantiles of every entry.
+
+    The estimated quantiles are exact up to the bin width
+    ``(upper - lower) / bins``. Values out of range are put in the outer bins.
+
+    Parameters
+    ----------
+    shape : :class:`tuple`
+        Shape of the ensemble members.
+    lower : :class:`float`
+        Lower bound of the histogram range.
+    upper : :class:`float`
+        Upper bound of the histogram range.
+    bins : :class:`int`, optional
+        Number of bins. Default: ``550``
+    """
+
+    def __init__(self, shape, lower, upper, bins=550):
+        self.edges = np.linspace(lower, upper, bins + 1)
+        self.counts = np.zeros(tuple(shape) + (bins,), dtype=np.uint32)
+
+    def add(self, value):
+        """Add a single member."""
+        bins = self.counts.shape[-1]
+        ids = np.searchsorted(self.edges, np.ravel(value), side="right") - 1
+        flat = self.counts.reshape(-1, bins)
+        flat[np.arange(flat.shape[0]), np.clip(ids, 0, bins - 1)] += 1
+
+    def merge(self, other):
+        """Merge the histograms of another (disjoint) ensemble."""
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        """Estimate the q-quantile of every entry (linear within the bins)."""
+        cdf = np.cumsum(self.counts, axis=-1, dtype=float)
+        total = np.maximum(cdf[..., -1:], 1)
+        cdf = np.concatenate((np.zeros_like(total), cdf / total), axis=-1)
+        ids = np.clip(np.sum(cdf < q, axis=-1) - 1, 0, len(self.edges) - 2)
+        c_lo = np.take_along_axis(cdf, ids[..., None], -1)[..., 0]
+        c_hi = np.take_along_axis(cdf, ids[..., None] + 1, -1)[..., 0]
+        frac = (q - c_lo) / np.where(c_hi > c_lo, c_hi - c_lo, 1)
+        width = self.edges[1] - self.edges[0]
+        return self.edges[ids] + np.clip(frac, 0, 1) * width
+
+
+class BlockMoments:
+    """
+    Running mean and variance of the means of blocks of correlated members.
+
+    Members of a block (like antithetic pairs or the points of a scrambled
+    quasi Monte Carlo sequence) are summed until the block is complete.
+    Incomplete blocks of different ranks are combined when merging.
+
+    Parameters
+    ----------
+    shape : :class:`tuple`
+        Shape of the ensemble members.
+    size : :class:`int`
+        Number of members of a block.
+    """
+
+    def __init__(self, shape, size):
+        self.size = int(size)
+        self.moments = Welford(shape)
+        # incomplete blocks: block number -> [count, sum]
+        self.open = {}
+
+    def add(self, seed_no, value, count=1):
+        """Add a member (or the sum of ``count`` members) to its block."""
+        block = self.open.setdefault(seed_no // self.size, [0, 0.0])
+        block[0] += count
+        block[1] = block[1] + value
+        if block[0] == self.size:
+            self.moments.add(block[1] / self.size)
+            del self.open[seed_no // self.size]
+
+    def merge(self, other):
+        """Merge the statistics of another (disjoint) ensemble."""
+        self.moments.merge(other.moments)
+        for block_no, (count, total) in other.open.items():
+            self.add(block_no * self.size, total, count)
+        return self
+
+    @property
+    def std_err(self):
+        """Standard error of the mean of the complete blocks."""
+        return self.moments.std_err
+
+    def reduction(self, var):
+        """Variance reduction against independent members of variance var."""
+        block_var = self.size * self.moments.var
+        return np.divide(var, block_var, out=np.ones_like(var), where=block_var > 0)
+
+
+class EnsembleStats:
+    """
+    Streaming statistics of the angular mean heads for all parameter sets.
+
+    Parameters
+    ----------
+    shape : :class:`tuple`
+        Shape of the ensemble members: ``(time, rad)``.
+    sketch : :class:`dict` or :any:`None`, optional
+        Keyword arguments for the :any:`HistSketch` (``lower``, ``upper``,
+        ``bins``) to also estimate quantiles. Default: :any:`None`
+    block_size : :class:`int`, optional
+        Number of correlated members in a block (given by consecutive
+        seeds) for variance-reduced sampling (see :any:`BlockMoments`).
+        Default: ``1``
+    """
+
+    def __init__(self, shape, sketch=None, block_size=1):
+        self.shape = tuple(shape)
+        self.sketch = sketch
+        self.block_size = int(block_size)
+        self.moments = {}
+        self.sketches = {}
+        self.blocks = {}
+
+    def add(self, para_no, value, seed_no=0):
+        """Add a member of the given parameter set."""
+        if para_no not in self.moments:
+            self.moments[para_no] = Welford(self.shape)
+            if self.sketch is not None:
+                self.sketches[para_no] = HistSketch(self.shape, **self.sketch)
+            if self.block_size > 1:
+                self.blocks[para_no] = BlockMoments(self.shape, self.block_size)
+        self.moments[para_no].add(value)
+        if self.sketch is not None:
+            self.sketches[para_no].add(value)
+        if self.block_size > 1:
+            self.blocks[para_no].add(seed_no, value)
+
+    def count(self, para_no):
+        """Number of independent samples (members or complete blocks)."""
+        if para_no in self.blocks:
+            return self.blocks[para_no].moments.count
+        return self.moments[para_no].count if para_no in self.moments else 0
+
+    def std_err(self, para_no):
+        """Standard error of the ensemble mean (from the complete blocks)."""
+        return self.blocks.get(para_no, self.moments[para_no]).std_err
+
+    def reduction(self, para_no, window=Ellipsis):
+        """Effective variance reduction of the mean (total in the window)."""
+        if para_no not in self.blocks:
+            return 1.0
+        var = self.moments[para_no].var[window]
+        block_var = self.block_size * self.blocks[para_no].moments.var[window]
+        return np.sum(var) / np.sum(block_var) if np.sum(block_var) > 0 else 1.0
+
+    def merge(self, other):
+        """Merge the statistics of another (disjoint) ensemble."""
+        for para_no, mom in other.moments.items():
+            if para_no in self.moments:
+                self.moments[para_no].merge(mom)
+            else:
+                self.moments[para_no] = mom
+        for para_no, skt in other.sketches.items():
+            if para_no in self.sketches:
+                self.sketches[para_no].merge(skt)
+            else:
+                self.sketches[para_no] = skt
+        for para_no, blk in other.blocks.items():
+            if para_no in self.blocks:
+                self.blocks[para_no].merge(blk)
+            else:
+                self.blocks[para_no] = blk
+        return self
+
+    def reduce(self, comm, root=0):
+        """Merge the statistics of all ranks on root (None elsewhere)."""
+        return comm.reduce(self, op=lambda a, b: a.merge(b), root=root)
+
+    def save(self, task_root, quantiles=()):
+        """Save mean, variance, count and quantiles for each parameter set."""
+        for para_no, mom in self.moments.items():
+            path = os.path.join(task_root, "para{:04}".format(para_no))
+            os.makedirs(path, exist_ok=True)
+            np.savetxt(os.path.join(path, "rad_mean_head.txt"), mom.mean)
+            np.savetxt(os.path.join(path, "rad_var_head.txt"), mom.var)
+            np.savetxt(os.path.join(path, "ens_count.txt"), [mom.count])
+            if para_no in self.blocks:
+                blk = self.blocks[para_no]
+                reduction = blk.reduction(mom.var)
+                np.savetxt(os.path.join(path, "rad_vr_head.txt"), reduction)
+                np.savetxt(os.path.join(path, "ens_blocks.txt"), [blk.moments.count])
+            for q in quantiles if para_no in self.sketches else ():
+                np.savetxt(
+                    os.path.join(path, "rad_q{:02}_head.txt".format(q)),
+                    self.sketches[para_no].quantile(q / 100),
+                )
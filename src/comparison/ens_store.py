@@ -0,0 +1,143 @@
+"""Chunked binary store of the ensemble results."""
+import os
+import glob
+import tempfile
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class EnsembleStore:
+    """
+    Store of the angular mean heads as a ``(para, seed, time, rad)`` cube.
+
+    The cube is split into memory-mapped ``.npy`` chunks of ``chunk`` seeds
+    per parameter set (``para0000/chunk0000.npy``, ...), initialized with NaN
+    for missing members. Chunks are created atomically on first use and
+    every member is a disjoint slice, so many writers can append at once.
+    The meta data (time, rad, para_set) is stored in ``meta.npz``.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, "meta.npz")) as meta:
+            self.time = meta["time"]
+            self.rad = meta["rad"]
+            self.para_set = meta["para_set"]
+            self.chunk = int(meta["chunk"])
+        self.shape = (len(self.time), len(self.rad))
+
+    @classmethod
+    def create(cls, path, time, rad, para_set, chunk=100):
+        """Create a new store (or open it if the meta data matches)."""
+        os.makedirs(path, exist_ok=True)
+        meta_file = os.path.join(path, "meta.npz")
+        if os.path.exists(meta_file):
+            store = cls(path)
+            # parameter sets could be appended
+            old_para = para_set[: len(store.para_set)]
+            same = (
+                np.array_equal(store.time, time)
+                and np.array_equal(store.rad, rad)
+                and np.array_equal(store.para_set, old_para)
+                and store.chunk == chunk
+            )
+            if not same:
+                raise ValueError("EnsembleStore: meta data doesn't match.")
+        # unique name (pids can repeat on the nodes of a shared file system)
+        fd, tmp = tempfile.mkstemp(suffix=".tmp.npz", prefix="meta_", dir=path)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, time=time, rad=rad, para_set=para_set, chunk=chunk)
+        os.replace(tmp, meta_file)
+        return cls(path)
+
+    def _chunk_file(self, para_no, chunk_no):
+        """Path to a chunk file."""
+        return os.path.join(
+            self.path,
+            "para{:04}".format(para_no),
+            "chunk{:04}.npy".format(chunk_no),
+        )
+
+    def _chunk(self, para_no, chunk_no, mode="r"):
+        """Memory-map a chunk (created with NaNs if needed for writing)."""
+        file = self._chunk_file(para_no, chunk_no)
+        if mode != "r" and not os.path.exists(file):
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(
+                suffix=".tmp.npy",
+                prefix=os.path.basename(file)[:-4] + "_",
+                dir=os.path.dirname(file),
+            )
+            os.close(fd)
+            new = open_memmap(
+                tmp, mode="w+", dtype=float, shape=(self.chunk,) + self.shape
+            )
+            new[...] = np.nan
+            new.flush()
+            del new
+            try:  # atomic: fails if another writer was faster
+                os.link(tmp, file)
+            except FileExistsError:
+                pass
+            os.remove(tmp)
+        return np.load(file, mmap_mode=mode)
+
+    def write(self, para_no, seed_no, head):
+        """Write the angular mean head of a single member."""
+        chunk_no, pos = divmod(seed_no, self.chunk)
+        data = self._chunk(para_no, chunk_no, mode="r+")
+        data[pos] = head
+        data.flush()
+
+    def _chunk_nos(self, para_no):
+        """Numbers of the existing chunks of a parameter set."""
+        para_dir = os.path.join(self.path, "para{:04}".format(para_no))
+        chunk_pattern = "chunk" + 4 * "[0-9]" + ".npy"
+        files = glob.glob(os.path.join(para_dir, chunk_pattern))
+        return sorted(int(os.path.basename(file)[5:9]) for file in files)
+
+    def chunks(self, para_no):
+        """Memory-mapped chunks of a parameter set (read-only)."""
+        chunk_nos = self._chunk_nos(para_no)
+        return [self._chunk(para_no, chunk_no) for chunk_no in chunk_nos]
+
+    def heads(self, para_no, seeds=None):
+        """Present members of a parameter set: (member, time, rad)."""
+        heads = []
+        for chunk_no in self._chunk_nos(para_no):
+            data = self._chunk(para_no, chunk_no)
+            select = ~np.isnan(data[:, 0, 0])
+            if seeds is not None:
+                chunk_seeds = chunk_no * self.chunk + np.arange(self.chunk)
+                select &= np.isin(chunk_seeds, seeds)
+            heads.append(data[select])
+        if not heads:
+            return np.empty((0,) + self.shape)
+        return np.concatenate(heads)
+
+    def count(self, para_no):
+        """Number of present members of a parameter set."""
+        return len(self.members(para_no))
+
+    def mean(self, para_no):
+        """Ensemble mean of a parameter set (reduced chunk by chunk)."""
+        total, count = np.zeros(self.shape), 0
+        for data in self.chunks(para_no):
+            present = ~np.isnan(data[:, 0, 0])
+            total += np.sum(data[present], axis=0)
+            count += np.sum(present)
+        return total / max(count, 1)
+
+    def members(self, para_no):
+        """Seed numbers of the present members of a parameter set."""
+        seeds = []
+        for chunk_no in self._chunk_nos(para_no):
+            data = self._chunk(para_no, chunk_no)
+            present = np.flatnonzero(~np.isnan(data[:, 0, 0]))
+            seeds.extend(int(seed) for seed in chunk_no * self.chunk + present)
+        return seeds
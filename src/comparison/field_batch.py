@@ -0,0 +1,194 @@
+"""Generate blocks of spatial random fields on a fixed mesh."""
+import numpy as np
+from gstools.field.summator import summate
+from gstools.normalizer.tools import apply_mean_norm_trend
+
+
+class FieldBatch:
+    """
+    Generate blocks of realizations of a spatial random field on a mesh.
+
+    The positions (element centroids) and the upscaled variance from the
+    element volumes are evaluated only once, since the mesh and the model
+    are fixed. For each seed, the random modes are sampled by the generator
+    of the given field, exactly like in ``srf.mesh``. The modes of all
+    seeds are then summed at once by vectorized numpy operations in blocks
+    of the elements (a single seed is summed by the Cython routine of
+    GSTools, which is faster on a single core).
+
+    For large meshes, a memory budget can be given. The fields are then
+    streamed over blocks of elements, each seed summed by the Cython routine
+    and transformed block by block, so only the output and temporaries of
+    the budget size are held in memory. Since all steps act element-wise,
+    the fields are bit-identical to the fields of single seeds generated
+    at once (and to ``srf.mesh``).
+
+    Parameters
+    ----------
+    srf : :class:`gstools.SRF`
+        Scalar spatial random field with the model, mean and upscaling.
+    mesh : :class:`ogs5py.MSH`
+        The mesh to generate the fields on (at the element centroids).
+    point_volumes : :class:`float` or :class:`numpy.ndarray`, optional
+        Volumes of the elements for the variance upscaling.
+        If ``0``, nothing is changed. Default: ``0``
+    max_size : :class:`int`, optional
+        Maximal number of phases (seeds x modes x elements) evaluated at
+        once to limit the memory usage. Default: ``2**23``
+    memory : :class:`int`, optional
+        Memory budget in bytes for the temporary arrays of the generation.
+        If given, the fields are generated in blocks of elements.
+        Default: :any:`None` (all elements at once)
+    dtype : :class:`numpy.dtype`, optional
+        Data type of the generated fields (e.g. ``numpy.float32`` to halve
+        the memory of the output). The fields are always calculated in
+        double precision. Default: ``numpy.float64``
+    """
+
+    def __init__(
+        self,
+        srf,
+        mesh,
+        point_volumes=0.0,
+        max_size=2 ** 23,
+        memory=None,
+        dtype=np.float64,
+    ):
+        if srf.value_type != "scalar":
+            raise ValueError("FieldBatch: only scalar fields supported.")
+        self.srf = srf
+        self.max_size = int(max_size)
+        self.dtype = np.dtype(dtype)
+        pos = mesh.centroids_flat.T[: srf.model.dim]
+        self.iso_pos, self.shape = srf.pre_pos(pos, "unstructured")
+        self.pos = srf.pos
+        self.size = self.iso_pos.shape[1]
+        # elements per block: double precision temporaries of the summation,
+        # nugget, scaling and transformation of a single seed
+        self.block = None
+        if memory is not None:
+            self.block = max(1, min(self.size, int(memory) // (8 * 4)))
+        self.scale = 1.0
+        if not np.isscalar(point_volumes) or not np.isclose(point_volumes, 0):
+            scaled_var = srf.upscaling_func(srf.model, point_volumes)
+            self.scale = np.sqrt(scaled_var / srf.model.sill)
+
+    def modes(self, seed):
+        """Random modes and nugget of the generator for the given seed."""
+        gen = self.srf.generator
+        gen.update(self.srf.model)
+        # always resample (update keeps the modes for an unchanged seed)
+        gen.reset_seed(seed)
+        # pylint: disable=protected-access
+        nugget = gen.get_nugget(self.shape)
+        return gen._cov_sample, gen._z_1, gen._z_2, nugget
+
+    def summate(self, cov_samples, z_1, z_2):
+        """
+        Sum up the random modes of multiple seeds.
+
+        Parameters
+        ----------
+        cov_samples : :class:`numpy.ndarray`
+            Wave numbers with shape ``(seeds, dim, modes)``.
+        z_1 : :class:`numpy.ndarray`
+            Cosine amplitudes with shape ``(seeds, modes)``.
+        z_2 : :class:`numpy.ndarray`
+            Sine amplitudes with shape ``(seeds, modes)``.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Summed modes with shape ``(seeds, elements)``.
+        """
+        seeds, __, mode_no = cov_samples.shape
+        if seeds == 1:
+            return summate(cov_samples[0], z_1[0], z_2[0], self.iso_pos)[None]
+        size = self.iso_pos.shape[1]
+        k_t = np.ascontiguousarray(np.swapaxes(cov_samples, 1, 2))
+        z_1, z_2 = z_1[:, None, :], z_2[:, None, :]
+        summed = np.empty((seeds, size))
+        step = max(1, self.max_size // (seeds * mode_no))
+        for start in range(0, size, step):
+            block = slice(start, start + step)
+            phase = np.matmul(k_t, self.iso_pos[:, block])
+            summed[:, block] = (
+                np.matmul(z_1, np.cos(phase))[:, 0]
+                + np.matmul(z_2, np.sin(phase))[:, 0]
+            )
+        return summed
+
+    def blocks(self):
+        """Slices of the element blocks (all elements if no memory budget)."""
+        if self.block is None:
+            return [slice(None)]
+        return [
+            slice(start, start + self.block)
+            for start in range(0, self.size, self.block)
+        ]
+
+    def generate(self, seeds):
+        """
+        Generate the fields for the given seeds.
+
+        Parameters
+        ----------
+        seeds : :class:`list` of :class:`int`
+            Seeds of the realizations.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The fields with shape ``(seeds, elements)``.
+        """
+        return self.fields([self.modes(seed) for seed in seeds])
+
+    def fields(self, modes):
+        """
+        Generate the fields for given random modes.
+
+        Parameters
+        ----------
+        modes : :class:`list` of :class:`tuple`
+            Random modes and nugget of the realizations as given by
+            :any:`FieldBatch.modes`.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The fields with shape ``(realizations, elements)``.
+        """
+        cov_samples, z_1, z_2, nugget = (list(mode) for mode in zip(*modes))
+        if self.block is None:
+            summed = self.summate(
+                np.array(cov_samples), np.array(z_1), np.array(z_2)
+            )
+            fields = self.transform(summed, nugget, slice(None))
+            return fields.astype(self.dtype, copy=False)
+        # stream over the element blocks, only the output has the full size
+        fields = np.empty((len(cov_samples), self.size), dtype=self.dtype)
+        for block in self.blocks():
+            pos = np.ascontiguousarray(self.iso_pos[:, block])
+            for i, cov_sample in enumerate(cov_samples):
+                summed = summate(cov_sample, z_1[i], z_2[i], pos)[None]
+                fields[i, block] = self.transform(summed, nugget[i : i + 1], block)
+        return fields
+
+    def transform(self, summed, nugget, block):
+        """Scale the summed modes of an element block and add mean and nugget."""
+        model, mode_no = self.srf.model, self.srf.generator.mode_no
+        fields = np.sqrt(model.var / mode_no) * summed
+        if model.nugget > 0:
+            fields += np.array([value[block] for value in nugget])
+        fields *= self.scale if np.isscalar(self.scale) else self.scale[block]
+        return apply_mean_norm_trend(
+            pos=self.pos[:, block],
+            field=fields,
+            mesh_type="unstructured",
+            value_type="scalar",
+            mean=self.srf.mean,
+            normalizer=self.srf.normalizer,
+            trend=self.srf.trend,
+            check_shape=False,
+            stacked=True,
+        )
@@ -0,0 +1,151 @@
+"""In-process solver for transient groundwater flow on a 2D mesh."""
+import numpy as np
+from scipy.sparse import csc_matrix
+from scipy.sparse.linalg import splu
+
+# 2x2 Gauss points and weights on the reference quad [-1, 1]^2
+_GAUSS = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) / np.sqrt(3)
+
+
+def _tri_matrices(nodes):
+    """Unit stiffness and mass matrices of linear triangles: (elem, 3, 3)."""
+    d_1 = nodes[:, 1] - nodes[:, 0]
+    d_2 = nodes[:, 2] - nodes[:, 0]
+    det = d_1[:, 0] * d_2[:, 1] - d_1[:, 1] * d_2[:, 0]
+    area = np.abs(det) / 2
+    # gradients of the shape functions (constant per element)
+    grad = np.empty(nodes.shape[:1] + (3, 2))
+    grad[:, 1] = np.stack((d_2[:, 1], -d_2[:, 0]), axis=-1) / det[:, None]
+    grad[:, 2] = np.stack((-d_1[:, 1], d_1[:, 0]), axis=-1) / det[:, None]
+    grad[:, 0] = -grad[:, 1] - grad[:, 2]
+    stiff = area[:, None, None] * np.einsum("eik,ejk->eij", grad, grad)
+    mass = area[:, None, None] / 12 * (np.ones((3, 3)) + np.eye(3))
+    return stiff, mass
+
+
+def _quad_matrices(nodes):
+    """Unit stiffness and mass matrices of bilinear quads: (elem, 4, 4)."""
+    sig = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]])
+    stiff = np.zeros(nodes.shape[:1] + (4, 4))
+    mass = np.zeros(nodes.shape[:1] + (4, 4))
+    for xi, eta in _GAUSS:
+        shape = (1 + sig[:, 0] * xi) * (1 + sig[:, 1] * eta) / 4
+        d_ref = np.stack(
+            (sig[:, 0] * (1 + sig[:, 1] * eta), sig[:, 1] * (1 + sig[:, 0] * xi)),
+            axis=-1,
+        ) / 4
+        jac = np.einsum("ik,eil->ekl", d_ref, nodes)
+        det = np.linalg.det(jac)
+        grad = np.einsum("ik,elk->eil", d_ref, np.linalg.inv(jac))
+        weight = np.abs(det)[:, None, None]
+        stiff += weight * np.einsum("eik,ejk->eij", grad, grad)
+        mass += weight * np.outer(shape, shape)
+    return stiff, mass
+
+
+class FlowSolver:
+    """
+    Transient groundwater flow by linear finite elements.
+
+    Solves the equation :math:`S\\partial_t h = \\nabla(T\\nabla h) + Q`
+    on a 2D mesh with element-wise transmissivity :math:`T`, constant
+    storativity :math:`S`, a point source :math:`Q` and fixed heads of zero,
+    starting with zero head. The elements are linear triangles and bilinear
+    quads with consistent mass matrices and the time stepping is implicit
+    Euler, like in OGS5. The element matrices are evaluated once per mesh
+    and the system is assembled by a precomputed sparsity pattern.
+    A factorization is needed per distinct step size. On the cubic time
+    grid of the workflow, all step sizes differ (one factorization per
+    step); only uniform time grids share a factorization.
+
+    Parameters
+    ----------
+    msh : :class:`ogs5py.MSH`
+        The 2D mesh with triangles and/or quads.
+    time : :class:`numpy.ndarray`
+        Output times (the first one is the start).
+    fixed : :class:`numpy.ndarray`
+        IDs of the nodes with fixed zero head.
+    source : :class:`int`
+        ID of the source node.
+    rate : :class:`float`
+        Source rate (negative for pumping).
+    """
+
+    def __init__(self, msh, time, fixed, source, rate):
+        self.time = np.array(time, dtype=float)
+        self.node_no = len(msh.NODES)
+        self.source = int(source)
+        self.rate = float(rate)
+        points = msh.NODES[:, :2]
+        elem_ids, rows, cols, stiff, mass = [], [], [], [], []
+        for typ, matrices in (("tri", _tri_matrices), ("quad", _quad_matrices)):
+            if typ not in msh.ELEMENTS:
+                continue
+            elems = msh.ELEMENTS[typ]
+            k_e, m_e = matrices(points[elems])
+            size = elems.shape[1]
+            elem_ids.append(np.repeat(msh.ELEMENT_ID[typ], size ** 2))
+            rows.append(np.repeat(elems, size, axis=1).ravel())
+            cols.append(np.tile(elems, size).ravel())
+            stiff.append(k_e.ravel())
+            mass.append(m_e.ravel())
+        self.elem_ids = np.concatenate(elem_ids)
+        self.stiff = np.concatenate(stiff)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        # only free nodes remain in the system (fixed heads are zero)
+        self.free = np.setdiff1d(np.arange(self.node_no), fixed)
+        index = np.full(self.node_no, -1)
+        index[self.free] = np.arange(len(self.free))
+        rows, cols = index[rows], index[cols]
+        keep = (rows >= 0) & (cols >= 0)
+        self.elem_ids, self.stiff = self.elem_ids[keep], self.stiff[keep]
+        # sparsity pattern (CSC: sorted by columns and rows)
+        size = len(self.free)
+        pattern, self.entry = np.unique(
+            cols[keep] * size + rows[keep], return_inverse=True
+        )
+        self.indices = pattern % size
+        self.indptr = np.searchsorted(pattern // size, np.arange(size + 1))
+        self.mass = self._matrix(np.concatenate(mass)[keep])
+        self.src = index[self.source]
+
+    def _matrix(self, values):
+        """Assemble a system matrix from the values of all element entries."""
+        data = np.bincount(self.entry, weights=values, minlength=len(self.indices))
+        size = len(self.free)
+        return csc_matrix((data, self.indices, self.indptr), shape=(size, size))
+
+    def __call__(self, trans, storage):
+        """
+        Solve for the heads with the given parameters.
+
+        Parameters
+        ----------
+        trans : :class:`numpy.ndarray`
+            Transmissivity for each element (ordered by element IDs).
+        storage : :class:`float`
+            Storativity.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Heads with shape ``(node, time)``.
+        """
+        stiff = self._matrix(self.stiff * np.asarray(trans)[self.elem_ids])
+        mass = storage * self.mass
+        head = np.zeros((self.node_no, len(self.time)))
+        current = np.zeros(len(self.free))
+        load = np.zeros(len(self.free))
+        if self.src >= 0:
+            load[self.src] = self.rate
+        # factorization per step size (ordering for symmetric systems)
+        factors = {}
+        for i, step in enumerate(np.diff(self.time), start=1):
+            if step not in factors:
+                factors[step] = splu(
+                    (mass / step + stiff).tocsc(), permc_spec="MMD_AT_PLUS_A"
+                )
+            current = factors[step].solve(mass.dot(current) / step + load)
+            head[self.free, i] = current
+        return head
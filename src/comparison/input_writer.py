@@ -0,0 +1,83 @@
+"""Fast writing of the OGS5 input files changing between realizations."""
+import os
+import hashlib
+import numpy as np
+
+
+class InputWriter:
+    """
+    Write the OGS5 input files of a model only if their content changed.
+
+    The element data of the distributed medium properties (mpd file) are
+    formatted by a single call from the field array into a template with
+    the element ids (same lines as written by ogs5py). The rest of the mpd
+    file is rendered by ogs5py once.
+
+    Parameters
+    ----------
+    model : :class:`ogs5py.OGS`
+        The OGS model with a single mpd block for the field.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        # content key of the last written version of each file
+        self.written = {}
+        # mpd file around the data and format of the data lines
+        self.head, self.tail, self.lines = None, None, None
+        self.size = None
+
+    def is_current(self, path, key):
+        """Whether the file was written with the given content before."""
+        return self.written.get(path) == key and os.path.exists(path)
+
+    def write(self, ogs_file):
+        """
+        Write an ogs5py input file if its content changed.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the file was written.
+        """
+        path, key = ogs_file.file_path, repr(ogs_file)
+        if self.is_current(path, key):
+            return False
+        ogs_file.write_file()
+        self.written[path] = key
+        return True
+
+    def template(self, size):
+        """Render the mpd file around the data for the given element count."""
+        mpd = self.model.mpd
+        mpd.update_block(DATA=[])
+        mpd.write_file()
+        with open(mpd.file_path) as mpd_file:
+            text = mpd_file.read()
+        stop = text.index("#STOP")
+        self.head, self.tail = text[:stop], text[stop:]
+        self.lines = "".join("{} %r\n".format(i) for i in range(size))
+        self.size = size
+
+    def write_mpd(self, field):
+        """
+        Write the element data (mpd) file of a field if it changed.
+
+        Returns
+        -------
+        :class:`bool`
+            Whether the file was written.
+        """
+        field = np.asarray(field, dtype=float).ravel()
+        if self.size != field.size:
+            self.template(field.size)
+        path = self.model.mpd.file_path
+        key = hashlib.sha1(field.tobytes()).hexdigest()
+        if self.is_current(path, key):
+            return False
+        with open(path, "w") as mpd_file:
+            mpd_file.write(self.head)
+            mpd_file.write(self.lines % tuple(field.tolist()))
+            mpd_file.write(self.tail)
+        self.written[path] = key
+        return True
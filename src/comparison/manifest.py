@@ -0,0 +1,122 @@
+"""Manifest of the ensemble tasks to checkpoint and resume simulations."""
+import os
+import glob
+import json
+import time
+from collections import Counter, deque
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Manifest:
+    """
+    Journal recording the state of all ``(para_no, seed_no)`` tasks.
+
+    Every writer (MPI rank or process) appends to its own journal file
+    ``<path>/<writer>.jsonl``, so no locking is needed.
+    The state of a task is given by its latest record over all journals,
+    where a completed task stays completed.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Directory of the manifest.
+    writer : :class:`str`
+        Name of the journal written by this instance.
+    """
+
+    def __init__(self, path, writer):
+        self.path = path
+        self.file = os.path.join(path, "{}.jsonl".format(writer))
+        os.makedirs(path, exist_ok=True)
+
+    def record(self, task, state):
+        """Record a new state for the given task."""
+        entry = {"para": int(task[0]), "seed": int(task[1]), "state": state}
+        entry["time"] = time.time()
+        with open(self.file, "a") as jrn:
+            jrn.write(json.dumps(entry) + "\n")
+            jrn.flush()
+            os.fsync(jrn.fileno())
+
+    def states(self):
+        """Current state of all recorded tasks as dictionary."""
+        entries = []
+        for file in glob.glob(os.path.join(self.path, "*.jsonl")):
+            with open(file) as jrn:
+                for line in jrn:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:  # line cut off by a killed job
+                        continue
+        states = {}
+        for entry in sorted(entries, key=lambda e: e["time"]):
+            task = (entry["para"], entry["seed"])
+            if states.get(task) != DONE:
+                states[task] = entry["state"]
+        return states
+
+    def pending(self, tasks, skip_failed=False):
+        """Tasks that are not completed yet (in-flight ones included)."""
+        states = self.states()
+        skip = (DONE, FAILED) if skip_failed else (DONE,)
+        return [task for task in tasks if states.get(tuple(task)) not in skip]
+
+    def clear(self):
+        """Remove all journal files to start from scratch."""
+        for file in glob.glob(os.path.join(self.path, "*.jsonl")):
+            os.remove(file)
+
+
+class RetryQueue:
+    """
+    Queue of tasks putting back failed tasks for a retry.
+
+    Failed tasks are put back at the end of the queue until they failed
+    ``retries + 1`` times. This bookkeeping is shared by all backends
+    (:any:`serve_tasks`, :any:`pool_tasks` and :any:`Pipeline.run_tasks`).
+
+    Parameters
+    ----------
+    tasks : :class:`list` or queue
+        Tasks to run, e.g. ``(para_no, seed_no)`` tuples.
+        A queue (like :any:`AdaptiveTasks`) providing ``popleft`` and
+        ``append`` is used directly and can grow while running.
+        Finally failed tasks are passed to its ``discard`` method if present.
+    retries : :class:`int`, optional
+        Number of retries for failed tasks. Default: ``0``
+    record : :any:`callable`, optional
+        Called with ``(task, state)`` whenever a task is started
+        or finished, e.g. :any:`Manifest.record`. Default: :any:`None`
+    """
+
+    def __init__(self, tasks, retries=0, record=None):
+        self.queue = tasks if hasattr(tasks, "popleft") else deque(tasks)
+        self.discard = getattr(self.queue, "discard", lambda task: None)
+        self.retries = retries
+        self.record = (lambda task, state: None) if record is None else record
+        self.attempts = Counter()
+        self.failed = []
+
+    def popleft(self):
+        """Next task (recorded as running)."""
+        task = self.queue.popleft()
+        self.record(task, RUNNING)
+        return task
+
+    def report(self, task, success):
+        """Record the outcome of a task and put it back if it can be retried."""
+        self.record(task, DONE if success else FAILED)
+        if success:
+            return
+        self.attempts[task] += 1
+        if self.attempts[task] > self.retries:
+            self.failed.append(task)
+            self.discard(task)
+        else:
+            self.queue.append(task)
+
+    def __bool__(self):
+        return bool(self.queue)
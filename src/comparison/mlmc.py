@@ -0,0 +1,236 @@
+"""Multilevel Monte Carlo estimation of the ensemble mean head."""
+import os
+from collections import deque
+import numpy as np
+from ens_stats import Welford
+
+
+def interp_matrix(rad_in, rad_out):
+    """Linear interpolation matrix from one radial grid to another."""
+    eye = np.eye(len(rad_in))
+    return np.array([np.interp(rad_out, rad_in, row) for row in eye]).T
+
+
+class MLMCTasks:
+    """
+    Queue of multilevel Monte Carlo samples with automatic allocation.
+
+    A sample ``(para_no, seed_no, level)`` on level 0 is a realization on
+    the coarsest mesh. On a higher level, it is the difference of the
+    realizations on the mesh of this level and on the next coarser mesh,
+    driven by the same random modes. The ensemble mean on the finest mesh
+    is estimated by the sum of the mean differences of all levels.
+
+    After ``pilot`` samples on every level, the number of samples is
+    allocated by the estimated variances ``V`` and costs ``C`` per sample
+    of all levels (Giles 2008)::
+
+        N_l = sqrt(V_l / C_l) * sum_k(sqrt(V_k * C_k)) / eps**2
+
+    with ``eps = tol * max(|mean|)`` in the given window. The variances are
+    the maxima in the window, so the standard error of the estimate is below
+    ``eps`` everywhere in the window. The allocation is repeated, when all
+    samples of a parameter set finished, until no more samples are needed.
+
+    The queue can be used in place of a :class:`collections.deque` of tasks
+    in :any:`pool_tasks` and :any:`serve_tasks`.
+
+    Parameters
+    ----------
+    para_nos : :class:`list` of :class:`int`
+        Parameter sets of the ensemble.
+    levels : :class:`int`
+        Number of levels.
+    shape : :class:`tuple`
+        Shape of the samples: ``(time, rad)``.
+    window : :class:`numpy.ndarray`
+        Boolean mask of shape ``(time, rad)`` for the error estimation.
+    tol : :class:`float`
+        Tolerance for the relative standard error of the mean.
+    pilot : :class:`int`, optional
+        Number of initial samples on every level. Default: ``20``
+    max_samples : :class:`int`, optional
+        Maximal number of samples on every level. Default: ``10000``
+    max_failures : :class:`int`, optional
+        Maximal number of finally failed samples on a level with less than
+        two successful ones. Then, the parameter set is given up.
+        Default: ``10``
+    """
+
+    def __init__(
+        self,
+        para_nos,
+        levels,
+        shape,
+        window,
+        tol,
+        pilot=20,
+        max_samples=10000,
+        max_failures=10,
+    ):
+        self.levels = int(levels)
+        self.window = np.asarray(window, dtype=bool)
+        self.tol = float(tol)
+        self.max_samples = int(max_samples)
+        self.max_failures = int(max_failures)
+        self.moments = {p: [Welford(shape) for __ in range(levels)] for p in para_nos}
+        # total wall time of the samples on each level
+        self.cost = {p: np.zeros(levels) for p in para_nos}
+        self.need = {p: np.full(levels, max(int(pilot), 2)) for p in para_nos}
+        self.issued = {p: np.zeros(levels, dtype=int) for p in para_nos}
+        self.running = {p: 0 for p in para_nos}
+        self.failures = {p: np.zeros(levels, dtype=int) for p in para_nos}
+        self.active = sorted(para_nos)
+        # parameter sets given up (levels without two successful samples)
+        self.failed = []
+        self.retry = deque()
+
+    def count(self, para_no):
+        """Number of finished samples on all levels."""
+        return np.array([mom.count for mom in self.moments[para_no]])
+
+    def mean(self, para_no):
+        """Multilevel estimate of the ensemble mean."""
+        return sum(mom.mean for mom in self.moments[para_no])
+
+    def std_err(self, para_no):
+        """Standard error of the multilevel estimate."""
+        return np.sqrt(sum(mom.std_err ** 2 for mom in self.moments[para_no]))
+
+    def error(self, para_no):
+        """Relative standard error of the estimate in the window."""
+        scale = np.max(np.abs(self.mean(para_no)[self.window]))
+        if not scale > 0:
+            return np.inf
+        return np.max(self.std_err(para_no)[self.window]) / scale
+
+    def allocate(self, para_no):
+        """Optimal number of samples on all levels."""
+        count = self.count(para_no)
+        if np.any(count < 2):  # replace failed pilot samples
+            need = self.issued[para_no] + np.maximum(2 - count, 0)
+            return np.minimum(need, self.max_samples)
+        var = np.array(
+            [np.max(mom.var[self.window]) for mom in self.moments[para_no]]
+        )
+        cost = self.cost[para_no] / count
+        eps = self.tol * np.max(np.abs(self.mean(para_no)[self.window]))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            need = np.sqrt(var / cost) * np.sum(np.sqrt(var * cost)) / eps ** 2
+        need = np.nan_to_num(np.ceil(need), nan=0.0, posinf=self.max_samples)
+        return np.minimum(need, self.max_samples).astype(int)
+
+    def update(self, para_no):
+        """Allocate new samples, when all samples of a parameter set finished."""
+        if para_no not in self.active or self.running[para_no]:
+            return
+        if np.any(self.issued[para_no] < self.need[para_no]):
+            return
+        count = self.count(para_no)
+        stuck = (count < 2) & (
+            (self.failures[para_no] >= self.max_failures)
+            | (self.issued[para_no] >= self.max_samples)
+        )
+        if np.any(stuck):
+            print(
+                "para {:04} FAILED: levels {} without two samples".format(
+                    para_no, list(np.flatnonzero(stuck))
+                )
+            )
+            self.active.remove(para_no)
+            self.failed.append(para_no)
+            return
+        need = np.maximum(self.need[para_no], self.allocate(para_no))
+        self.need[para_no] = need
+        if np.all(need <= self.issued[para_no]):
+            print(
+                "para {:04} finished: samples {}, rel. std. err. {:.2e}".format(
+                    para_no, list(self.count(para_no)), self.error(para_no)
+                )
+            )
+            self.active.remove(para_no)
+
+    def collect(self, task, result):
+        """Add a finished sample ``(value, cost)``."""
+        para_no, __, level = task
+        value, cost = result
+        self.moments[para_no][level].add(value)
+        self.cost[para_no][level] += cost
+        self.running[para_no] -= 1
+        self.update(para_no)
+
+    def discard(self, task):
+        """Drop a finally failed sample."""
+        para_no, __, level = task
+        self.failures[para_no][level] += 1
+        self.running[para_no] -= 1
+        self.update(para_no)
+
+    def next_task(self):
+        """Parameter set and level of the next new sample (or None)."""
+        for para_no in self.active:
+            levels = np.flatnonzero(self.issued[para_no] < self.need[para_no])
+            if levels.size:  # most expensive levels first
+                return para_no, int(levels[-1])
+        return None
+
+    def popleft(self):
+        """Next task to run."""
+        if self.retry:
+            return self.retry.popleft()
+        task = self.next_task()
+        if task is None:
+            raise IndexError("pop from an empty queue")
+        para_no, level = task
+        self.issued[para_no][level] += 1
+        self.running[para_no] += 1
+        return para_no, int(self.issued[para_no][level] - 1), level
+
+    def append(self, task):
+        """Put back a failed task."""
+        self.retry.append(task)
+
+    def __bool__(self):
+        return bool(self.retry) or self.next_task() is not None
+
+    def save(self, task_root):
+        """Save mean, standard error and samples per level of all sets."""
+        for para_no, moments in self.moments.items():
+            if para_no in self.failed:
+                continue
+            path = os.path.join(task_root, "para{:04}".format(para_no))
+            os.makedirs(path, exist_ok=True)
+            np.savetxt(os.path.join(path, "rad_mean_head.txt"), self.mean(para_no))
+            np.savetxt(os.path.join(path, "rad_err_head.txt"), self.std_err(para_no))
+            np.savetxt(os.path.join(path, "ens_count.txt"), [moments[-1].count])
+            count = self.count(para_no)
+            var = [np.max(mom.var[self.window]) for mom in moments]
+            np.savetxt(
+                os.path.join(path, "mlmc_levels.txt"),
+                np.column_stack(
+                    (count, var, self.cost[para_no] / np.maximum(count, 1))
+                ),
+                header="samples, max. variance (window), cost per sample [s]",
+            )
+
+    def report(self):
+        """Print samples, variance and cost per level of all sets."""
+        for para_no, moments in sorted(self.moments.items()):
+            if para_no in self.failed:
+                print("para {:04}: FAILED".format(para_no))
+                continue
+            count = self.count(para_no)
+            print(
+                "para {:04}: rel. std. err. {:.2e}".format(
+                    para_no, self.error(para_no)
+                )
+            )
+            for level, mom in enumerate(moments):
+                print(
+                    "  level {}: {:6d} samples, var {:.3e}, {:.3f} s".format(
+                        level,
+                        count[level],
+                        np.max(mom.var[self.window]),
+                        self.cost[para_no][level] / max(count[level], 1),
+                    )
+                )
@@ -0,0 +1,112 @@
+"""Pipelined execution of realizations overlapping the solver with python."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from manifest import RetryQueue
+
+
+class Pipeline:
+    """
+    Overlap the solver run of a realization with the python stages of others.
+
+    Slots are independent task runners (e.g. realizations in separate task
+    directories) providing three stages, that are called with the task as
+    arguments:
+
+    * ``prepare``: set up the task (e.g. generate and write the field)
+    * ``solve``: run the solver (e.g. OGS), returns the success
+    * ``finish``: post-process and clean up, returns the success
+
+    While a slot solves its task in a background thread, the next task is
+    prepared in another slot and the previous one is finished.
+    Two slots are sufficient to keep the solver busy.
+
+    Parameters
+    ----------
+    slots : :class:`list`
+        Task runners with the stages ``prepare``, ``solve`` and ``finish``.
+    collect : :any:`callable`, optional
+        Called with ``(task, slot)`` after a task was finished successfully,
+        e.g. to collect the results of the slot. Default: :any:`None`
+    """
+
+    def __init__(self, slots, collect=None):
+        if len(slots) < 2:
+            raise ValueError("Pipeline: needs at least two slots.")
+        self.free = deque(slots)
+        self.collect = (lambda task, slot: None) if collect is None else collect
+        self.executor = ThreadPoolExecutor(1)
+        self.running = None
+
+    def submit(self, task):
+        """
+        Start a task.
+
+        Returns
+        -------
+        :class:`list`
+            Reports ``(task, success)`` of the tasks finished meanwhile.
+        """
+        slot = self.free.popleft()
+        slot.prepare(*task)  # overlaps with the running solve
+        reports = self.drain(finish=False)
+        self.running = (task, slot, self.executor.submit(slot.solve, *task))
+        return [self._finish(*report) for report in reports]
+
+    def drain(self, finish=True):
+        """Wait for the running task and finish it. Returns the reports."""
+        if self.running is None:
+            return []
+        task, slot, future = self.running
+        self.running = None
+        report = (task, slot, future.result())
+        return [self._finish(*report) if finish else report]
+
+    def _finish(self, task, slot, success):
+        """Finish a solved task (overlaps with the next solve)."""
+        if success:
+            success = slot.finish(*task)
+        if success:
+            self.collect(task, slot)
+        self.free.append(slot)
+        return task, success
+
+    def run_tasks(self, tasks, retries=0, record=None):
+        """
+        Run the given tasks in the pipeline.
+
+        Failed tasks are retried by a :any:`RetryQueue`.
+
+        Parameters
+        ----------
+        tasks : :class:`list` or queue
+            Tasks to run, e.g. ``(para_no, seed_no)`` tuples.
+            A queue (like :any:`AdaptiveTasks`) providing ``popleft`` and
+            ``append`` is used directly and can grow while running.
+            Finally failed tasks are passed to its ``discard`` method if
+            present.
+        retries : :class:`int`, optional
+            Number of retries for failed tasks. Default: ``0``
+        record : :any:`callable`, optional
+            Called with ``(task, state)`` whenever a task is started
+            or finished, e.g. :any:`Manifest.record`. Default: :any:`None`
+
+        Returns
+        -------
+        :class:`list`
+            Tasks that finally failed.
+        """
+        queue = RetryQueue(tasks, retries, record)
+        while queue or self.running is not None:
+            if queue:
+                reports = self.submit(queue.popleft())
+            else:
+                reports = self.drain()
+            for task, success in reports:
+                queue.report(task, success)
+        return queue.failed
+
+    def close(self):
+        """Finish the running task and stop the solver thread."""
+        reports = self.drain()
+        self.executor.shutdown()
+        return reports
@@ -0,0 +1,88 @@
+"""Process-pool backend to run ensemble tasks on a single node."""
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from manifest import RetryQueue
+
+# task runner of the current worker process
+_RUN = None
+
+
+def _init_worker(worker_ids, factory):
+    """Create the task runner of a new worker process."""
+    global _RUN
+    _RUN = factory(worker_ids.get())
+    if hasattr(_RUN, "close"):
+        # called when the worker exits (atexit handlers are skipped)
+        Finalize(None, _RUN.close, exitpriority=10)
+
+
+def _run_task(task):
+    """Run a task in the worker process."""
+    return _RUN(*task)
+
+
+def pool_tasks(
+    tasks, factory, workers, retries=0, record=None, collect=None
+):
+    """
+    Run tasks on a pool of local worker processes.
+
+    Every worker gets a unique id in ``range(workers)`` to set up its own
+    task runner (e.g. a separate task directory). Failed tasks are retried
+    by a :any:`RetryQueue`.
+
+    Parameters
+    ----------
+    tasks : :class:`list` or queue
+        Tasks to run, e.g. ``(para_no, seed_no)`` tuples.
+        A queue (like :any:`AdaptiveTasks`) providing ``popleft`` and
+        ``append`` is used directly and can grow while running.
+        Finally failed tasks are passed to its ``discard`` method if present.
+    factory : :any:`callable`
+        Picklable function creating the task runner of a worker from its id:
+        ``run = factory(worker_id)``. The runner is called by ``run(*task)``
+        and needs to return ``(success, result)``. Its ``close`` method
+        is called when the worker exits, if present.
+    workers : :class:`int`
+        Number of worker processes.
+    retries : :class:`int`, optional
+        Number of retries for failed tasks. Default: ``0``
+    record : :any:`callable`, optional
+        Called with ``(task, state)`` whenever a task is submitted
+        or finished, e.g. :any:`Manifest.record`. Default: :any:`None`
+    collect : :any:`callable`, optional
+        Called with ``(task, result)`` for every successful task.
+        Default: :any:`None`
+
+    Returns
+    -------
+    :class:`list`
+        Tasks that finally failed.
+    """
+    collect = (lambda task, result: None) if collect is None else collect
+    worker_ids = mp.Queue()
+    for worker_id in range(workers):
+        worker_ids.put(worker_id)
+    queue = RetryQueue(tasks, retries, record)
+    running = {}
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(worker_ids, factory)
+    ) as executor:
+        while queue or running:
+            # keep all workers busy without submitting everything at once
+            while queue and len(running) < 2 * workers:
+                task = queue.popleft()
+                running[executor.submit(_run_task, task)] = task
+            finished, __ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    success, result = future.result()
+                except Exception as err:  # pylint: disable=broad-except
+                    print("  task", task, "raised:", repr(err))
+                    success = False
+                queue.report(task, success)
+                if success:
+                    collect(task, result)
+    return queue.failed
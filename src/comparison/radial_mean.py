@@ -0,0 +1,43 @@
+"""Radial averaging of nodal values on arbitrary meshes."""
+import numpy as np
+from scipy import sparse
+
+
+def radial_mean_operator(points, rad):
+    """
+    Generate a sparse operator averaging nodal values along angles.
+
+    Every node is assigned to the nearest radius in ``rad`` (measured from
+    the origin in the x-y-plane) and the operator holds the averaging weights
+    ``1 / n_i``, where ``n_i`` is the number of nodes assigned to radius i.
+    Since the assignment is purely based on the node coordinates, this also
+    works for non-radial and unstructured meshes.
+    Radii without any assigned node will get a mean of 0.
+
+    Parameters
+    ----------
+    points : :class:`numpy.ndarray`
+        Node coordinates of shape (n, 2) or (n, 3).
+    rad : :class:`numpy.ndarray`
+        Radii to average the nodal values on.
+
+    Returns
+    -------
+    :class:`scipy.sparse.csr_matrix`
+        Averaging operator of shape (len(rad), n).
+        Apply it to nodal values of shape (n, ...) by ``op @ values``.
+    """
+    points = np.asarray(points, dtype=float)
+    rad = np.asarray(rad, dtype=float).reshape(-1)
+    radii = np.hypot(points[:, 0], points[:, 1])
+    # nearest radius by bisecting the midpoints between the (sorted) radii
+    order = np.argsort(rad, kind="stable")
+    srt_rad = rad[order]
+    mid = 0.5 * (srt_rad[1:] + srt_rad[:-1])
+    rad_ids = order[np.searchsorted(mid, radii, side="left")]
+    count = np.bincount(rad_ids, minlength=rad.size)
+    weights = 1.0 / count[rad_ids]
+    return sparse.csr_matrix(
+        (weights, (rad_ids, np.arange(radii.size))),
+        shape=(rad.size, radii.size),
+    )
@@ -0,0 +1,132 @@
+"""Variance-reduced sampling of the random modes of the ensemble fields."""
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+SCHEMES = ["mc", "antithetic", "sobol", "halton"]
+
+
+def block_size(scheme, qmc_block=16):
+    """Number of correlated members in a block of a sampling scheme."""
+    return {"mc": 1, "antithetic": 2}.get(scheme, qmc_block)
+
+
+def radial_ppf(model, points=4001, span=1e6):
+    """
+    Tabulated inverse CDF of the radial spectral density of a model.
+
+    Used for models without an analytic ppf (like the truncated power laws),
+    where GSTools samples the radii by MCMC, which can't be driven by
+    quasi-random numbers.
+
+    Parameters
+    ----------
+    model : :any:`gstools.CovModel`
+        The covariance model.
+    points : :class:`int`, optional
+        Number of logarithmically spaced radii. Default: ``4001``
+    span : :class:`float`, optional
+        The radii range from ``1/span`` to ``span`` times the inverse
+        rescaled length scale. Default: ``1e6``
+
+    Returns
+    -------
+    :any:`callable`
+        The inverse CDF.
+    """
+    if model.has_ppf:
+        return model.dist_func[2]
+    rad = np.geomspace(1 / span, span, points) / model.len_rescaled
+    pdf_rad = model.spectral_rad_pdf(rad) * rad
+    # trapezoidal rule in log-space, normalized to the covered mass
+    cdf = np.cumsum(np.diff(np.log(rad)) * (pdf_rad[1:] + pdf_rad[:-1]) / 2)
+    cdf = np.concatenate(([0.0], cdf / cdf[-1]))
+    log_rad = np.log(rad)
+    return lambda q: np.exp(np.interp(q, cdf, log_rad))
+
+
+class Sampler:
+    """
+    Random modes of the realizations for different sampling schemes.
+
+    * ``mc``: independent seeds (plain Monte Carlo)
+    * ``antithetic``: pairs of seeds sharing the random modes with mirrored
+      amplitudes, so the log-fields of a pair are mirrored around the mean
+    * ``sobol``/``halton``: randomized quasi Monte Carlo, every block of
+      ``qmc_block`` seeds is given by the points of an independently
+      scrambled low-discrepancy sequence over all modes
+
+    The members of a block (pair or scrambled sequence) are correlated, so
+    only the means of the blocks are independent (see :any:`BlockMoments`).
+
+    Parameters
+    ----------
+    batch : :any:`FieldBatch`
+        Field generator of the current parameter set.
+    seed : :any:`callable`
+        Seed of a block: ``seed(block_no)``.
+    scheme : :class:`str`, optional
+        Sampling scheme, one of :any:`SCHEMES`. Default: ``"mc"``
+    qmc_block : :class:`int`, optional
+        Points per scrambled sequence for quasi Monte Carlo. Default: ``16``
+    """
+
+    def __init__(self, batch, seed, scheme="mc", qmc_block=16):
+        if scheme not in SCHEMES:
+            raise ValueError("Sampler: unknown scheme '{}'".format(scheme))
+        self.batch = batch
+        self.seed = seed
+        self.scheme = scheme
+        self.block_size = block_size(scheme, qmc_block)
+        self.ppf = None
+        # all points of the current block of the quasi Monte Carlo sequence
+        self.points = (None, None)
+        # modes of the current antithetic pair
+        self.pair = (None, None)
+        if scheme in ["sobol", "halton"]:
+            model = batch.srf.model
+            if model.dim > 3:
+                raise ValueError("Sampler: QMC only for dimensions up to 3")
+            self.ppf = radial_ppf(model)
+
+    def modes(self, seed_no):
+        """Random modes and nugget of a realization (see FieldBatch.modes)."""
+        block_no, index = divmod(seed_no, self.block_size)
+        if self.scheme == "mc":
+            return self.batch.modes(self.seed(seed_no))
+        if self.scheme == "antithetic":
+            if self.pair[0] != block_no:
+                self.pair = (block_no, self.batch.modes(self.seed(block_no)))
+            cov_sample, z_1, z_2, nugget = self.pair[1]
+            sign = -1.0 if index else 1.0
+            return cov_sample, sign * z_1, sign * z_2, sign * nugget
+        return self.qmc_modes(block_no, index)
+
+    def qmc_modes(self, block_no, index):
+        """Modes from a point of the scrambled sequence of a block."""
+        gen, shape = self.batch.srf.generator, self.batch.shape
+        dim, mode_no = self.batch.srf.model.dim, gen.mode_no
+        # uniforms per mode: radius, direction (dim - 1, at least one)
+        # and the two amplitudes
+        rows = max(dim, 2) + 2
+        if self.points[0] != block_no:
+            engine = qmc.Sobol if self.scheme == "sobol" else qmc.Halton
+            engine = engine(rows * mode_no, seed=self.seed(block_no))
+            self.points = (block_no, engine.random(self.block_size))
+        uni = self.points[1][index].reshape(rows, mode_no)
+        # keep away from 0 and 1 for the inverse CDFs
+        uni = np.clip(uni, 1e-12, 1 - 1e-12)
+        z_1, z_2 = ndtri(uni[-2]), ndtri(uni[-1])
+        if dim == 1:
+            sphere = np.where(uni[1] < 0.5, -1.0, 1.0)[None]
+        else:
+            ang1 = 2 * np.pi * uni[1]
+            sphere = np.array([np.cos(ang1), np.sin(ang1)])
+            if dim == 3:
+                ang2 = 2 * uni[2] - 1
+                sphere = np.vstack((np.sqrt(1 - ang2 ** 2) * sphere, ang2))
+        nugget = 0.0
+        if not np.isclose(self.batch.srf.model.nugget, 0):
+            rng = np.random.default_rng(self.seed(block_no) + index)
+            nugget = np.sqrt(self.batch.srf.model.nugget) * rng.normal(size=shape)
+        return self.ppf(uni[0]) * sphere, z_1, z_2, nugget
@@ -0,0 +1,130 @@
+"""Scheduling of ensemble tasks over MPI ranks."""
+from collections import Counter, deque
+from mpi4py import MPI
+from manifest import RetryQueue
+from pipeline import Pipeline
+
+# message tags between master and workers
+TAG_REQUEST = 1
+TAG_TASK = 2
+
+
+def static_tasks(tasks, comm=MPI.COMM_WORLD):
+    """Tasks for the calling rank by a fixed round-robin assignment."""
+    rank, size = comm.Get_rank(), comm.Get_size()
+    return [task for i, task in enumerate(tasks) if i % size == rank]
+
+
+def serve_tasks(
+    tasks, comm=MPI.COMM_WORLD, retries=0, record=None, collect=None
+):
+    """
+    Hand out tasks to all other ranks on demand (master side).
+
+    Workers report the outcome of their finished tasks, when they ask for
+    a new one. Failed tasks are retried by a :any:`RetryQueue`. Workers are
+    only released, when there is no work left and all tasks were reported
+    (pipelined workers ask for new tasks before the running ones are
+    finished and a growing queue could hand out new tasks after the last
+    reports). Until then, idle workers wait for new tasks.
+
+    Parameters
+    ----------
+    tasks : :class:`list` or queue
+        Tasks to be distributed, e.g. ``(para_no, seed_no)`` tuples.
+        A queue (like :any:`AdaptiveTasks`) providing ``popleft`` and
+        ``append`` is used directly and can grow while serving.
+        Finally failed tasks are passed to its ``discard`` method if present.
+    comm : :class:`mpi4py.MPI.Comm`, optional
+        Communicator. Default: ``MPI.COMM_WORLD``
+    retries : :class:`int`, optional
+        Number of retries for failed tasks. Default: ``0``
+    record : :any:`callable`, optional
+        Called with ``(task, state)`` whenever a task is handed out
+        or reported, e.g. :any:`Manifest.record`. Default: :any:`None`
+    collect : :any:`callable`, optional
+        Called with ``(task, result)`` for every successful task with the
+        result sent by the worker (see :any:`request_tasks`).
+        Default: :any:`None`
+
+    Returns
+    -------
+    :class:`list`
+        Tasks that finally failed.
+    """
+    collect = (lambda task, result: None) if collect is None else collect
+    queue = RetryQueue(tasks, retries, record)
+    # tasks handed out but not reported yet for each worker
+    pending = Counter()
+    # workers waiting for a task
+    idle = deque()
+    status = MPI.Status()
+    active = comm.Get_size() - 1
+    while active:
+        reports = comm.recv(source=MPI.ANY_SOURCE, tag=TAG_REQUEST, status=status)
+        source = status.Get_source()
+        for task, success, result in reports:
+            pending[source] -= 1
+            queue.report(task, success)
+            if success:
+                collect(task, result)
+        idle.append(source)
+        while idle and queue:
+            worker = idle.popleft()
+            task = queue.popleft()
+            pending[worker] += 1
+            comm.send(task, dest=worker, tag=TAG_TASK)
+        # no work left: pipelined workers need to report their running tasks,
+        # the others are released when all tasks were reported
+        for worker in list(idle):
+            if pending[worker] or not any(pending.values()):
+                idle.remove(worker)
+                comm.send(None, dest=worker, tag=TAG_TASK)
+                if not pending[worker]:
+                    active -= 1
+    return queue.failed
+
+
+def request_tasks(run, comm=MPI.COMM_WORLD, master=0, results=None):
+    """
+    Run tasks handed out by the master until there is no work left.
+
+    Parameters
+    ----------
+    run : :any:`callable` or :any:`Pipeline`
+        Function running a single task given as arguments: ``run(*task)``.
+        Needs to return the success as :class:`bool`.
+        A :any:`Pipeline` asks for the next task while running the last one.
+    comm : :class:`mpi4py.MPI.Comm`, optional
+        Communicator. Default: ``MPI.COMM_WORLD``
+    master : :class:`int`, optional
+        Rank of the master. Default: ``0``
+    results : :class:`dict`, optional
+        Results of the successful tasks by task (e.g. filled by the collect
+        callback of the :any:`Pipeline`) to be sent to the master with the
+        reports. Sent results are removed. Default: :any:`None`
+
+    Returns
+    -------
+    :class:`int`
+        Number of tasks run by this worker.
+    """
+    if isinstance(run, Pipeline):
+        submit, drain = run.submit, run.drain
+    else:
+        submit, drain = (lambda task: [(task, run(*task))]), list
+    results = {} if results is None else results
+    reports = []
+    count = 0
+    while True:
+        reports = [(task, ok, results.pop(task, None)) for task, ok in reports]
+        comm.send(reports, dest=master, tag=TAG_REQUEST)
+        task = comm.recv(source=master, tag=TAG_TASK)
+        if task is None:
+            # report running tasks (they could be handed out again on failure)
+            reports = drain()
+            if not reports:
+                return count
+            continue
+        reports = submit(task)
+        count += 1
@@ -0,0 +1,65 @@
+"""Node-local scratch staging of the OGS runs with background cleanup."""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Scratch:
+    """
+    Node-local scratch directory (e.g. on tmpfs) of a worker.
+
+    The task directories and the OGS output of the realizations are placed
+    here instead of the shared results tree. Outputs are removed (or moved to
+    the results tree) by a background thread, so the cleanup is not in the
+    critical path of the realizations.
+
+    Parameters
+    ----------
+    root : :class:`str`
+        Base directory, e.g. ``/dev/shm`` (created if missing).
+    name : :class:`str`
+        Prefix of the unique scratch directory of the worker.
+    """
+
+    def __init__(self, root, name):
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=name + "_", dir=root)
+        self.executor = ThreadPoolExecutor(1)
+        self.futures = []
+
+    def submit(self, func, *args):
+        """Run a cleanup function in the background."""
+        self.collect()
+        self.futures.append(self.executor.submit(func, *args))
+
+    def collect(self, wait=False):
+        """Drop the finished (or all awaited) cleanups and report errors."""
+        pending = []
+        for future in self.futures:
+            if not (wait or future.done()):
+                pending.append(future)
+            elif future.exception() is not None:
+                print("  scratch cleanup failed:", repr(future.exception()))
+        self.futures = pending
+
+    def remove(self, path):
+        """Remove a directory in the background."""
+        self.submit(shutil.rmtree, path, True)
+
+    def move(self, path, target):
+        """Move a directory to the results tree in the background."""
+        self.submit(_move, path, target)
+
+    def close(self, remove=True):
+        """Wait for the background cleanup and remove the scratch directory."""
+        self.collect(wait=True)
+        self.executor.shutdown()
+        if remove:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _move(path, target):
+    """Copy a directory to the target (merged) and remove it."""
+    shutil.copytree(path, target, dirs_exist_ok=True)
+    shutil.rmtree(path)
@@ -0,0 +1,116 @@
+"""Per-realization timings and resource usage of the ensemble runs."""
+import os
+import sys
+import json
+import time as timer
+import socket
+import resource
+import threading
+from contextlib import contextmanager
+
+# I/O counters of the calling thread (only available on Linux)
+_IO = "/proc/thread-self/io" if os.path.exists("/proc/thread-self/io") else None
+
+
+def io_counters():
+    """Bytes read and written by the calling thread (0 if not available)."""
+    if _IO is None:
+        return 0, 0
+    with open(_IO) as io_file:
+        counters = dict(line.split(":") for line in io_file)
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+def peak_rss():
+    """Peak resident set size in MB of this process and its largest child."""
+    # ru_maxrss is given in kB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return tuple(
+        resource.getrusage(who).ru_maxrss * unit / 1e6
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    )
+
+
+class Record:
+    """
+    Telemetry of a single realization.
+
+    Parameters
+    ----------
+    **info
+        Identification of the realization (like ``para`` and ``seed``).
+    """
+
+    def __init__(self, **info):
+        self.data = dict(info, start=timer.time(), stages={})
+        self._start = timer.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Measure wall time and I/O of a stage (accumulated if repeated)."""
+        read, written = io_counters()
+        start = timer.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.data["stages"].setdefault(
+                name, {"time": 0.0, "read": 0, "written": 0}
+            )
+            stage["time"] += timer.perf_counter() - start
+            read_end, written_end = io_counters()
+            stage["read"] += read_end - read
+            stage["written"] += written_end - written
+
+    def finish(self, **info):
+        """Add the total wall time, the peak memory and further info."""
+        self.data["wall"] = timer.perf_counter() - self._start
+        self.data["peak_rss"], self.data["peak_rss_children"] = peak_rss()
+        self.data.update(info)
+        return self.data
+
+
+class Telemetry:
+    """
+    Writer of the realization telemetry as JSON lines (one file per rank).
+
+    Each line holds the identification of the realization, its start time
+    (unix time), the wall time, the wall time and bytes read and written
+    by the python process for each stage, the peak RSS in MB (of the process
+    and its largest child, i.e. OGS5) and further info like the success
+    and the OGS5 exit status.
+
+    Parameters
+    ----------
+    path : :class:`str`, optional
+        Output directory. If ``None``, nothing is written. Default: ``None``
+    name : :class:`str`, optional
+        Name of the rank (file ``<name>.jsonl``). Default: ``"rank"``
+    """
+
+    def __init__(self, path=None, name="rank"):
+        self.name = name
+        self.host = socket.gethostname()
+        self.file = None
+        self._lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self.file = open(os.path.join(path, name + ".jsonl"), "a")
+
+    def record(self, **info):
+        """Start the telemetry record of a realization."""
+        return Record(rank=self.name, host=self.host, pid=os.getpid(), **info)
+
+    def write(self, record, **info):
+        """Finish a record and write it."""
+        data = record.finish(**info)
+        if self.file is None:
+            return
+        with self._lock:
+            self.file.write(json.dumps(data) + "\n")
+            self.file.flush()
+
+    def close(self):
+        """Close the output file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,193 @@
+"""Selective reader for single point data arrays of OGS5 PVD/VTU output."""
+import os
+import re
+import zlib
+import base64
+import numpy as np
+
+# VTK data types
+_TYPES = {
+    b"Int8": "i1",
+    b"UInt8": "u1",
+    b"Int16": "i2",
+    b"UInt16": "u2",
+    b"Int32": "i4",
+    b"UInt32": "u4",
+    b"Int64": "i8",
+    b"UInt64": "u8",
+    b"Float32": "f4",
+    b"Float64": "f8",
+}
+_ATTR = re.compile(rb'([\w:]+)\s*=\s*"([^"]*)"')
+_ARRAY = re.compile(rb"<DataArray\b([^>]*?)(/?)>")
+
+
+def _attrs(tag):
+    """Attributes of a XML tag as dictionary."""
+    return dict(_ATTR.findall(tag))
+
+
+def _b64_len(size):
+    """Number of base64 characters encoding the given number of bytes."""
+    return 4 * ((size + 2) // 3)
+
+
+def pvd_files(path, task_id="model", pcs="GROUNDWATER_FLOW"):
+    """Time steps and VTU files listed in the PVD file of an OGS5 output."""
+    file = os.path.join(path, "{}_{}.pvd".format(task_id, pcs))
+    with open(file, "rb") as pvd:
+        content = pvd.read()
+    times, files = [], []
+    for tag in re.findall(rb"<DataSet\b([^>]*)>", content):
+        attrs = _attrs(tag)
+        times.append(float(attrs[b"timestep"]))
+        files.append(os.path.join(path, attrs[b"file"].decode()))
+    return np.array(times), files
+
+
+class _Format:
+    """Binary layout of a VTU file given by the ``VTKFile`` attributes."""
+
+    def __init__(self, attrs):
+        order = "<" if attrs.get(b"byte_order") != b"BigEndian" else ">"
+        self.order = order
+        self.header = np.dtype(
+            order + _TYPES[attrs.get(b"header_type", b"UInt32")]
+        )
+        self.compressed = b"compressor" in attrs
+
+    def dtype(self, attrs):
+        """Numpy data type of a data array."""
+        return np.dtype(self.order + _TYPES[attrs.get(b"type", b"Float64")])
+
+    def raw(self, data, start, dtype):
+        """Decode a raw binary block starting at the given position."""
+        hsize = self.header.itemsize
+        if not self.compressed:
+            size = int(np.frombuffer(data, self.header, 1, start)[0])
+            # zero-copy view on the file content
+            return np.frombuffer(data, dtype, size // dtype.itemsize, start + hsize)
+        nblocks = int(np.frombuffer(data, self.header, 1, start)[0])
+        sizes = np.frombuffer(data, self.header, nblocks, start + 3 * hsize)
+        pos = start + (3 + nblocks) * hsize
+        blocks = []
+        for size in sizes.astype(int):
+            blocks.append(zlib.decompress(data[pos : pos + size]))
+            pos += size
+        return np.frombuffer(b"".join(blocks), dtype)
+
+    def base64(self, text, dtype):
+        """
+        Decode a base64 encoded block (header and data can be separate).
+
+        Only the characters of the block given by its header are decoded,
+        so the text can continue with the following blocks (appended data).
+        """
+        text = b"".join(text.split())
+        hsize = self.header.itemsize
+        hlen = _b64_len(hsize)
+        if not self.compressed:
+            first = base64.b64decode(text[:hlen])
+            size = int(np.frombuffer(first, self.header, 1)[0])
+            if text[hlen - 1 : hlen] == b"=":  # separately encoded header
+                data = base64.b64decode(text[hlen : hlen + _b64_len(size)])
+                return np.frombuffer(data, dtype, size // dtype.itemsize)
+            data = base64.b64decode(text[: _b64_len(hsize + size)])
+            return np.frombuffer(data, dtype, size // dtype.itemsize, hsize)
+        # compressed: header (with block sizes) is encoded separately
+        first = base64.b64decode(text[:hlen])[:hsize]
+        nblocks = int(np.frombuffer(first, self.header)[0])
+        hlen = _b64_len((3 + nblocks) * hsize)
+        header = np.frombuffer(base64.b64decode(text[:hlen]), self.header)
+        size = int(np.sum(header[3:]))
+        data = base64.b64decode(text[hlen : hlen + _b64_len(size)])
+        return self.raw(header.tobytes() + data, 0, dtype)
+
+
+def read_point_data(file, name="HEAD"):
+    """
+    Read a single point data array from a VTU file.
+
+    Only the requested array is decoded (ascii, inline binary or appended
+    data, optionally zlib compressed). Uncompressed binary data is returned
+    as a read-only view on the file content without copying.
+
+    Parameters
+    ----------
+    file : :class:`str`
+        Path to the VTU file.
+    name : :class:`str`, optional
+        Name of the point data array. Default: ``"HEAD"``
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        The point data (with shape ``(points, components)`` for vectors).
+    """
+    with open(file, "rb") as vtu:
+        data = vtu.read()
+    vtk_file = re.search(rb"<VTKFile\b([^>]*)>", data)
+    fmt = _Format(_attrs(vtk_file.group(1)))
+    start = data.find(b"<PointData", vtk_file.end())
+    end = data.find(b"</PointData>", start)
+    for match in _ARRAY.finditer(data, start, end):
+        attrs = _attrs(match.group(1))
+        if attrs.get(b"Name") == name.encode():
+            break
+    else:
+        raise ValueError("read_point_data: '{}' not in {}".format(name, file))
+    dtype = fmt.dtype(attrs)
+    encoding = attrs.get(b"format", b"ascii")
+    if encoding == b"appended":
+        app = data.find(b"<AppendedData", end)
+        app_attrs = _attrs(data[app : data.find(b">", app)])
+        # data starts after the leading underscore
+        base = data.find(b"_", app) + 1
+        offset = base + int(attrs[b"offset"])
+        if app_attrs.get(b"encoding") == b"raw":
+            values = fmt.raw(data, offset, dtype)
+        else:
+            stop = data.find(b"<", offset)
+            values = fmt.base64(data[offset:stop], dtype)
+    else:
+        content = data[match.end() : data.find(b"</DataArray>", match.end())]
+        if encoding == b"ascii":
+            values = np.fromstring(content, dtype=dtype, sep=" ")
+        else:
+            values = fmt.base64(content, dtype)
+    comps = int(attrs.get(b"NumberOfComponents", 1))
+    return values if comps == 1 else values.reshape(-1, comps)
+
+
+def read_pvd_point_data(
+    path, steps=None, name="HEAD", task_id="model", pcs="GROUNDWATER_FLOW"
+):
+    """
+    Read a point data array for all requested time steps of an OGS5 output.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        Output directory of the model.
+    steps : :class:`int` or :any:`None`, optional
+        Number of time steps to read (from the start). Default: all
+    name : :class:`str`, optional
+        Name of the point data array. Default: ``"HEAD"``
+    task_id : :class:`str`, optional
+        Task ID of the model. Default: ``"model"``
+    pcs : :class:`str`, optional
+        Process type of the output. Default: ``"GROUNDWATER_FLOW"``
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        The point data with shape ``(points, time)``.
+    """
+    __, files = pvd_files(path, task_id, pcs)
+    files = files[:steps]
+    first = read_point_data(files[0], name)
+    out = np.empty((len(first), len(files)), dtype=first.dtype)
+    out[:, 0] = first
+    for i, file in enumerate(files[1:], start=1):
+        out[:, i] = read_point_data(file, name)
+    return out
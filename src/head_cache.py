@@ -0,0 +1,176 @@
+"""Persistent on-disk cache for the effective head solutions."""
+import os
+import hashlib
+import inspect
+import functools
+import numpy as np
+import anaflow as ana
+import tpl_table
+from tpl_sweep import ext_theis_tpl_sweep as _sweep
+
+# default cache directory (independent of the working directory)
+CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "results", "cache"
+)
+
+
+def _feed(hasher, value):
+    """Feed a canonical representation of a value to the hash."""
+    if isinstance(value, dict):
+        for key in sorted(value):
+            hasher.update(repr(key).encode())
+            _feed(hasher, value[key])
+    elif isinstance(value, (list, tuple, np.ndarray)) or np.ndim(value) > 0:
+        value = np.asarray(value)
+        if value.dtype == object:
+            raise TypeError("DiskCache: can't hash object arrays.")
+        value = np.ascontiguousarray(value)
+        hasher.update("{}{}".format(value.dtype.str, value.shape).encode())
+        hasher.update(value.tobytes())
+    elif isinstance(value, (float, np.floating)):
+        hasher.update(float(value).hex().encode())
+    else:
+        hasher.update(repr(value).encode())
+
+
+def _source_hash(*modules):
+    """Hash of the source code of the given modules (the code version)."""
+    hasher = hashlib.sha256()
+    for module in modules:
+        hasher.update(inspect.getsource(module).encode())
+    return hasher.hexdigest()[:16]
+
+
+class DiskCache:
+    """
+    Content-addressed cache of arrays on disk with LRU eviction.
+
+    Results are stored as ``.npy`` files (``.npz`` for tuples of arrays)
+    named by the SHA-256 hash of the function and all its arguments. Files
+    are written to a temporary file and atomically moved in place, so
+    concurrent readers and writers only ever see complete results. The
+    access time is tracked by the file modification time and the least
+    recently used files are removed, when the cache exceeds the given size.
+
+    Parameters
+    ----------
+    path : :class:`str`, optional
+        Cache directory. Default: ``results/cache``
+    max_size : :class:`int`, optional
+        Maximal size of the cache in bytes. Default: 1 GB
+    """
+
+    def __init__(self, path=CACHE_DIR, max_size=2 ** 30):
+        self.path = path
+        self.max_size = max_size
+
+    def key(self, name, arguments):
+        """Hash of a function name and its arguments given as dictionary."""
+        hasher = hashlib.sha256(name.encode())
+        _feed(hasher, dict(arguments))
+        return hasher.hexdigest()
+
+    def _file(self, key, ext=".npy"):
+        """Path of the file for the given key."""
+        return os.path.join(self.path, key + ext)
+
+    def get(self, key):
+        """Load a cached result (None if not present)."""
+        for ext in (".npy", ".npz"):
+            file = self._file(key, ext)
+            try:
+                if ext == ".npy":
+                    value = np.load(file)
+                else:  # tuple of arrays
+                    with np.load(file) as data:
+                        value = tuple(
+                            data["arr_{}".format(i)] for i in range(len(data.files))
+                        )
+                os.utime(file)  # mark as recently used
+            except (FileNotFoundError, ValueError, OSError):
+                continue
+            return value
+        return None
+
+    def put(self, key, value):
+        """Store a result (an array or a tuple of arrays)."""
+        os.makedirs(self.path, exist_ok=True)
+        ext = ".npz" if isinstance(value, tuple) else ".npy"
+        tmp = self._file(key, ext) + ".{}.tmp".format(os.getpid())
+        with open(tmp, "wb") as f:
+            if isinstance(value, tuple):
+                np.savez(f, *value)
+            else:
+                np.save(f, np.asarray(value))
+        os.replace(tmp, self._file(key, ext))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used results above the size limit."""
+        entries = []
+        with os.scandir(self.path) as files:
+            for entry in files:
+                name, ext = os.path.splitext(entry.name)
+                # only results (other files like the TPL_CG table are kept)
+                if ext not in (".npy", ".npz") or len(name) != 64:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for __, file_size, file in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def clear(self):
+        """Remove all cached results."""
+        max_size, self.max_size = self.max_size, -1
+        if os.path.exists(self.path):
+            self.evict()
+        self.max_size = max_size
+
+    def __call__(self, func, depends=()):
+        """
+        Decorate a function to cache its results.
+
+        The key contains the AnaFlow version and a hash of the source code
+        of the module of the function and of the modules it ``depends`` on,
+        so changes of the code invalidate the cached results.
+        """
+        signature = inspect.signature(func)
+        code = _source_hash(inspect.getmodule(func), *depends)
+        name = "{}.{}-{}-{}".format(
+            func.__module__, func.__qualname__, ana.__version__, code
+        )
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = self.key(name, bound.arguments)
+            value = self.get(key)
+            if value is None:
+                value = func(*args, **kwargs)
+                if isinstance(value, tuple):
+                    value = tuple(np.asarray(val) for val in value)
+                else:
+                    value = np.asarray(value)
+                self.put(key, value)
+            return value
+
+        wrapper.cache = self
+        return wrapper
+
+
+CACHE = DiskCache()
+ext_theis_tpl = CACHE(ana.ext_theis_tpl)
+ext_thiem_tpl = CACHE(ana.ext_thiem_tpl)
+# tabulated sweeps depend on the lookup table
+ext_theis_tpl_sweep = CACHE(_sweep, depends=(tpl_table,))
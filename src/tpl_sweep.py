@@ -0,0 +1,485 @@
+"""Batched evaluation of the effective TPL head for parameter sweeps."""
+import numpy as np
+from scipy.special import gamma, iv, kv
+from anaflow import ext_grf
+from anaflow.tools.coarse_graining import TPL_CG, TPL_CG_error
+from anaflow.tools.laplace import c_array
+from anaflow.tools.mean import annular_hmean
+from anaflow.tools.special import specialrange_cut, sph_surf
+import tpl_table
+
+
+def annular_hmean_gl(func, val_arr, ann_dim=2, order=16, rtol=None, **kwargs):
+    """
+    Annular harmonic means of a radial function by Gauss-Legendre quadrature.
+
+    Vectorized version of :any:`anaflow.tools.mean.annular_hmean`: the
+    function is evaluated by a single call on the nodes of the Gauss-Legendre
+    rules of the given order and of half the order in all annuli at once.
+    The difference of both rules is the error estimate.
+
+    Parameters
+    ----------
+    func : :any:`callable`
+        Radial function called by ``func(rad, **kwargs)`` with an array of
+        radii (and ``func(np.inf, **kwargs)`` for an infinite last annulus).
+    val_arr : :class:`numpy.ndarray`
+        Radii defining the annuli.
+    ann_dim : :class:`float`, optional
+        The dimension of the annuli. Default: ``2``
+    order : :class:`int`, optional
+        Number of nodes per annulus. Default: ``16``
+    rtol : :class:`float`, optional
+        If given, the annuli with a larger estimated relative error are
+        integrated adaptively by :any:`anaflow.tools.mean.annular_hmean`
+        (with an error estimate of zero). Default: :any:`None`
+    **kwargs
+        Keyword arguments of the function.
+
+    Returns
+    -------
+    means : :class:`numpy.ndarray`
+        Harmonic means in the annuli.
+    error : :class:`numpy.ndarray`
+        Estimated relative errors of the means.
+    """
+    val_arr = np.array(val_arr, dtype=float).reshape(-1)
+    if len(val_arr) < 2 or np.any(np.diff(val_arr) <= 0):
+        raise ValueError("annular_hmean_gl: need at least 2 sorted radii.")
+    finite = np.isfinite(val_arr[1:])
+    r_in, r_out = val_arr[:-1][finite, None], val_arr[1:][finite, None]
+    rules = [np.polynomial.legendre.leggauss(n) for n in (order, order // 2)]
+    nodes = np.concatenate([node for node, __ in rules])
+    rad = (r_out + r_in) / 2 + (r_out - r_in) / 2 * nodes
+    val = rad ** (ann_dim - 1) / func(rad.ravel(), **kwargs).reshape(rad.shape)
+    vol = (r_out[:, 0] ** ann_dim - r_in[:, 0] ** ann_dim) / ann_dim
+    weights = (r_out - r_in) / 2
+    means = [
+        vol / np.sum(weights * weight * part, axis=1)
+        for (__, weight), part in zip(rules, np.split(val, [order], axis=1))
+    ]
+    result, error = np.zeros((2, len(val_arr) - 1))
+    result[finite] = means[0]
+    if not np.all(finite):  # the function at infinity like in AnaFlow
+        result[~finite] = func(np.inf, **kwargs)
+    error[finite] = np.abs(means[0] - means[1]) / np.abs(means[0])
+    if rtol is not None:
+        for i in np.flatnonzero(error > rtol):
+            sub = val_arr[i : i + 2]
+            result[i] = annular_hmean(func, sub, ann_dim=ann_dim, **kwargs)[0]
+            error[i] = 0.0
+    return result, error
+
+
+def adaptive_partitions(
+    func, r_in, r_out, tol, max_parts=100, points=9, min_width=1e-4, **kwargs
+):
+    """
+    Radii of annuli with a bounded variation of a radial function.
+
+    Starting with a single annulus, the annulus with the largest variation
+    is bisected (in ``log(1 + r)`` like the ``"exp"`` range of
+    :any:`anaflow.tools.special.specialrange`) until the relative half
+    range ``(max - min) / (max + min)`` of the function is below ``tol`` in
+    all annuli. This is the relative error of the step function with the
+    mid-range value in each annulus (close to the harmonic mean for small
+    variations). The annuli get narrow only where the function varies fast.
+    Annuli narrower than ``min_width`` times the whole range (in
+    ``log(1 + r)``) are not bisected (e.g. at the well, where
+    :any:`anaflow.tools.coarse_graining.TPL_CG` steps to the well value).
+
+    Parameters
+    ----------
+    func : :any:`callable`
+        Radial function like :any:`anaflow.tools.coarse_graining.TPL_CG`
+        called by ``func(rad, **kwargs)``.
+    r_in : :class:`float`
+        Inner radius.
+    r_out : :class:`float`
+        Outer radius (finite).
+    tol : :class:`float`
+        Tolerance for the relative error of the step function.
+    max_parts : :class:`int`, optional
+        Maximal number of annuli. Default: ``100``
+    points : :class:`int`, optional
+        Number of radii per annulus to sample the function. Default: ``9``
+    min_width : :class:`float`, optional
+        Minimal width of bisected annuli relative to the whole range
+        (in ``log(1 + r)``). Default: ``1e-4``
+    **kwargs
+        Keyword arguments of the function.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Radii separating the annuli (the number of annuli is one less).
+    """
+    samples = np.linspace(0, 1, points)
+    min_width *= np.log1p(r_out) - np.log1p(r_in)
+
+    def variation(x_1, x_2):
+        """Relative half range of the function in an annulus."""
+        if x_2 - x_1 < min_width:
+            return 0.0
+        val = func(np.expm1(x_1 + (x_2 - x_1) * samples), **kwargs)
+        return (np.max(val) - np.min(val)) / (np.max(val) + np.min(val))
+
+    x_part = [np.log1p(r_in), np.log1p(r_out)]
+    error = [variation(*x_part)]
+    while max(error) > tol and len(error) < max_parts:
+        i = int(np.argmax(error))
+        x_mid = (x_part[i] + x_part[i + 1]) / 2
+        x_part.insert(i + 1, x_mid)
+        error[i : i + 1] = [
+            variation(x_part[i], x_mid),
+            variation(x_mid, x_part[i + 2]),
+        ]
+    R_part = np.expm1(x_part)
+    R_part[[0, -1]] = r_in, r_out
+    return R_part
+
+
+def tpl_partitions(
+    cond_gmean,
+    len_scale,
+    hurst,
+    var,
+    dim=2.0,
+    r_well=0.0,
+    r_bound=np.inf,
+    K_well="KH",
+    prop=1.6,
+    far_err=0.01,
+    parts=30,
+    tol=None,
+    order=16,
+    tabulated=False,
+):
+    """
+    Annuli and their conductivities of the effective TPL solution.
+
+    This is the setup of :any:`anaflow.ext_theis_tpl`, which doesn't
+    depend on the storage. If a tolerance is given, the annuli up to the
+    cut-off radius are placed by :any:`adaptive_partitions` (with at most
+    ``parts`` annuli) instead of a fixed number of annuli. The harmonic
+    means of the annuli are calculated by :any:`annular_hmean_gl` with the
+    given order, only annuli with an estimated relative error above
+    ``1e-8`` are integrated adaptively (all if the order is ``0``).
+    If ``tabulated``, the conductivity is evaluated by the lookup table of
+    :any:`tpl_table.TPL_CG` (the cut-off radius is calculated exactly).
+
+    Returns
+    -------
+    R_part : :class:`numpy.ndarray`
+        Radii separating the annuli.
+    K_part : :class:`numpy.ndarray`
+        Harmonic mean of the conductivity in each annulus.
+    K_well : :class:`float`
+        Conductivity at the well.
+    """
+    kw = dict(
+        cond_gmean=cond_gmean,
+        len_scale=len_scale,
+        hurst=hurst,
+        var=var,
+        c=1.0,
+        anis=1,
+        dim=dim,
+        K_well=K_well,
+        prop=prop,
+    )
+    r_last = TPL_CG_error(far_err, **kw)
+    cond = tpl_table.TPL_CG if tabulated else TPL_CG
+    if r_last > r_well and tol is not None:
+        # one annulus is left for the far field beyond the cut-off
+        far = r_last < r_bound
+        r_cut = r_last if far else r_bound
+        R_part = adaptive_partitions(
+            cond, r_well, r_cut, tol, max(parts - far, 1), **kw
+        )
+        if far:
+            R_part = np.append(R_part, r_bound)
+    elif r_last > r_well:
+        R_part = specialrange_cut(r_well, r_bound, parts + 1, r_last)
+    else:
+        R_part = np.array([r_well, r_bound])
+    if order:
+        K_part = annular_hmean_gl(
+            cond, R_part, ann_dim=dim, order=order, rtol=1e-8, **kw
+        )[0]
+    else:
+        K_part = annular_hmean(cond, R_part, ann_dim=dim, **kw)
+    return R_part, K_part, float(cond(r_well, **kw))
+
+
+def grf_laplace_batch(
+    s, rad, S_part, K_part, R_part, dim, lat_ext, rate, K_well, prec=1e-20
+):
+    """
+    Extended GRF model in Laplace space for a batch of aquifers.
+
+    Vectorized version of :any:`anaflow.flow.laplace.grf_laplace` for
+    constant pumping, where each Laplace-space point comes with its own
+    annuli. The banded equation systems of all points are set up at once,
+    truncated at the first annulus without impact like in AnaFlow and
+    solved by a vectorized elimination without pivoting (like pentapy).
+
+    Parameters
+    ----------
+    s : :class:`numpy.ndarray`
+        Laplace-space points with shape ``(n,)``.
+    rad : :class:`numpy.ndarray`
+        Radii where the heads are evaluated.
+    S_part : :class:`numpy.ndarray`
+        Storage of the annuli with shape ``(n, parts)``.
+    K_part : :class:`numpy.ndarray`
+        Conductivity of the annuli with shape ``(n, parts)``.
+    R_part : :class:`numpy.ndarray`
+        Radii separating the annuli with shape ``(n, parts + 1)``.
+    dim : :class:`float`
+        Flow dimension.
+    lat_ext : :class:`float`
+        Lateral extend of the aquifer.
+    rate : :class:`float`
+        Pumping rate.
+    K_well : :class:`numpy.ndarray`
+        Conductivity at the well with shape ``(n,)``.
+    prec : :class:`float`, optional
+        Cut-off precision to select the annuli. Default: ``1e-20``
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Heads in Laplace space with shape ``(n, rad)``.
+    """
+    nu = 1.0 - dim / 2.0
+    nu1 = nu - 1
+    num, parts = K_part.shape
+    size = 2 * parts
+    difsr = np.sqrt(S_part / K_part)
+    r_well, r_bound = R_part[:, 0], R_part[:, -1]
+    well, bound = r_well > 0.0, r_bound < np.inf
+    # pumping condition at the well (constant pumping)
+    q_s = -((2 / difsr[:, 0]) ** nu) * s ** (-nu / 2) / s
+    q_s[well] = -(
+        s[well] ** (-0.5) / difsr[well, 0] * r_well[well] ** nu1 / s[well]
+    )
+    c_s = np.sqrt(s)[:, None] * difsr
+    # the banded matrices (column-wise like in AnaFlow)
+    mat = np.zeros((num, 5, size))
+    mat[:, 2, 0] = -gamma(1 - nu)
+    mat[:, 1, 1] = 2.0 / gamma(nu)
+    mat[:, 2, -1] = 1.0
+    tmp = K_part[:, :-1] / K_part[:, 1:] * difsr[:, :-1] / difsr[:, 1:]
+    arg_i = c_s[:, :-1] * R_part[:, 1:-1]  # inner side of the interfaces
+    arg_o = c_s[:, 1:] * R_part[:, 1:-1]  # outer side of the interfaces
+    col = 2 * np.arange(parts - 1)
+    with np.errstate(all="ignore"):
+        mat[:, 0, col + 3] = -iv(nu, arg_o)
+        mat[:, 1, col + 2] = -kv(nu, arg_o)
+        mat[:, 1, col + 3] = -iv(nu1, arg_o)
+        mat[:, 2, col + 1] = iv(nu, arg_i)
+        mat[:, 2, col + 2] = kv(nu1, arg_o)
+        mat[:, 3, col] = kv(nu, arg_i)
+        mat[:, 3, col + 1] = tmp * iv(nu1, arg_i)
+        mat[:, 4, col] = -tmp * kv(nu1, arg_i)
+        # boundary conditions
+        arg = c_s[well, 0] * r_well[well]
+        mat[well, 2, 0] = -kv(nu1, arg)
+        mat[well, 1, 1] = iv(nu1, arg)
+        arg = c_s[bound, -1] * r_bound[bound]
+        mat[bound, 3, -2] = kv(nu, arg)
+        mat[bound, 2, -1] = iv(nu, arg)
+    mat[~bound, :2, -1] = 0
+    # first annulus without impact (at least one is used)
+    mat_cond = np.max(np.abs(mat), axis=1)
+    cut = (mat_cond < prec) | (mat_cond > 1 / prec)
+    first = np.where(np.any(cut, axis=1), np.argmax(cut, axis=1) // 2, parts)
+    used = 2 * np.maximum(first, 1)[:, None, None]
+    # decouple the unused coefficients (set to 0 by an identity block)
+    row = np.arange(size) + np.arange(5)[:, None] - 2
+    unused = np.arange(size) >= used
+    mat[unused | (row >= used)] = 0.0
+    mat[:, 2][unused[:, 0]] = 1.0
+    # row-wise band: band[:, i, k] = A[i, i + k - 2]
+    band = np.zeros((num, size, 5))
+    for k in range(5):
+        rows = np.arange(max(0, 2 - k), min(size, size + 2 - k))
+        band[:, rows, k] = mat[:, 4 - k, rows + k - 2]
+    rhs = np.zeros((num, size))
+    rhs[:, 0] = q_s
+    with np.errstate(all="ignore"):
+        for i in range(size - 1):
+            for r in (1, 2)[: size - 1 - i]:
+                fac = band[:, i + r, 2 - r] / band[:, i, 2]
+                band[:, i + r, 2 - r : 5 - r] -= fac[:, None] * band[:, i, 2:]
+                rhs[:, i + r] -= fac * rhs[:, i]
+        coef = np.zeros((num, size + 2))
+        for i in range(size - 1, -1, -1):
+            coef[:, i] = (
+                rhs[:, i]
+                - band[:, i, 3] * coef[:, i + 1]
+                - band[:, i, 4] * coef[:, i + 2]
+            ) / band[:, i, 2]
+    coef = np.nan_to_num(coef[:, :size])
+    # calculate the head (ignore small values)
+    pos = np.sum(R_part[:, :, None] < rad, axis=1) - 1
+    c_r = np.take_along_axis(c_s, pos, axis=1) * rad
+    coef_k = np.take_along_axis(coef, 2 * pos, axis=1)
+    coef_i = np.take_along_axis(coef, 2 * pos + 1, axis=1)
+    with np.errstate(all="ignore"):
+        k0_sub = np.where(np.abs(coef_k) < prec, 0, coef_k * kv(nu, c_r))
+        i0_sub = np.where(np.abs(coef_i) < prec, 0, coef_i * iv(nu, c_r))
+        res = np.nan_to_num(rad ** nu * (k0_sub + i0_sub))
+    res *= (rate / (K_well * sph_surf(dim) * lat_ext ** (3.0 - dim)))[:, None]
+    return res
+
+
+def ext_theis_tpl_sweep(
+    time,
+    rad,
+    storage,
+    cond_gmean,
+    len_scale,
+    hurst,
+    var,
+    dim=2.0,
+    lat_ext=1.0,
+    rate=-1e-4,
+    r_well=0.0,
+    r_bound=np.inf,
+    h_bound=0.0,
+    K_well="KH",
+    prop=1.6,
+    far_err=0.01,
+    parts=30,
+    max_size=2 ** 22,
+    tol=None,
+    order=16,
+    tabulated=False,
+    return_parts=False,
+):
+    """
+    The extended Theis solution for TPL fields for many parameter sets.
+
+    Batched version of :any:`anaflow.ext_theis_tpl` on a structured grid.
+    The parameters are broadcasted against each other and the work is
+    shared where possible: the annuli are only set up once for parameter
+    sets differing in the storage, the Stehfest nodes are common to all
+    parameter sets and the Laplace-space solutions of all sets are
+    evaluated at once by :any:`grf_laplace_batch`.
+
+    Parameters
+    ----------
+    time : :class:`numpy.ndarray`
+        Time points.
+    rad : :class:`numpy.ndarray`
+        Radii.
+    storage, cond_gmean, len_scale, hurst, var : :class:`numpy.ndarray`
+        Storage, geometric mean conductivity, length scale, hurst
+        coefficient and variance of the log-conductivity of all
+        parameter sets (broadcasted against each other).
+    dim, lat_ext, rate, r_well, r_bound, h_bound, K_well, prop, far_err,
+    parts :
+        Like in :any:`anaflow.ext_theis_tpl` (shared by all sets).
+    max_size : :class:`int`, optional
+        Maximal number of matrix entries (Laplace-space points x bands x
+        coefficients) evaluated at once to limit the memory usage.
+        Default: ``2**22``
+    tol : :class:`float`, optional
+        Tolerance for the relative error of the step function of the
+        conductivity. If given, the annuli are placed adaptively (at most
+        ``parts``, see :any:`tpl_partitions`). Default: :any:`None`
+    order : :class:`int`, optional
+        Order of the Gauss-Legendre rule for the harmonic means of the
+        annuli (see :any:`tpl_partitions`). Default: ``16``
+    tabulated : :class:`bool`, optional
+        Whether to evaluate the conductivity by the lookup table of
+        :any:`tpl_table.TPL_CG`. Default: :any:`False`
+    return_parts : :class:`bool`, optional
+        Whether to also return the number of annuli used for each parameter
+        set (e.g. to report the adaptive partitioning). Default: :any:`False`
+
+    Returns
+    -------
+    head : :class:`numpy.ndarray`
+        Heads with shape ``(para, time, rad)``.
+    parts : :class:`numpy.ndarray`
+        Number of annuli with shape ``(para,)``. Only if ``return_parts``.
+    """
+    time = np.array(time, dtype=float, ndmin=1)
+    rad = np.array(rad, dtype=float, ndmin=1)
+    paras = np.broadcast_arrays(
+        *(
+            np.array(para, dtype=float, ndmin=1).ravel()
+            for para in (storage, cond_gmean, len_scale, hurst, var)
+        )
+    )
+    paras = np.stack(paras, axis=-1)
+    if np.any(time < 0):
+        raise ValueError("ext_theis_tpl_sweep: time needs to be >= 0.")
+    if np.min(rad) <= r_well or np.max(rad) > r_bound:
+        raise ValueError("ext_theis_tpl_sweep: radii out of range.")
+    # the partitions are independent of the storage
+    setups, index = np.unique(paras[:, 1:], axis=0, return_inverse=True)
+    index = np.reshape(index, -1)
+    setups = [
+        tpl_partitions(
+            *setup,
+            dim,
+            r_well,
+            r_bound,
+            K_well,
+            prop,
+            far_err,
+            parts,
+            tol,
+            order,
+            tabulated,
+        )
+        for setup in setups
+    ]
+    # common Stehfest nodes for all parameter sets
+    c_fac = c_array(12)
+    time_gz = time > 0
+    t_fac = np.log(2.0) / time[time_gz]
+    nodes = np.outer(t_fac, np.arange(1, 13)).ravel()
+    kw = dict(rad=rad, dim=dim, lat_ext=lat_ext, rate=rate)
+    head = np.zeros((len(paras), len(time), len(rad)))
+    # group by the number of annuli
+    counts = np.array([len(setup[1]) for setup in setups])[index]
+    for count in np.unique(counts):
+        group = np.where(counts == count)[0]
+        if count == 1:  # no heterogeneity to batch
+            for para_no in group:
+                R_part, K_part, k_well = setups[index[para_no]]
+                head[para_no] = ext_grf(
+                    time,
+                    S_part=np.full_like(K_part, paras[para_no, 0]),
+                    K_part=K_part,
+                    R_part=R_part,
+                    K_well=k_well,
+                    **kw,
+                )
+            continue
+        step = max(1, max_size // (len(nodes) * 10 * count))
+        for start in range(0, len(group), step):
+            block = group[start : start + step]
+            setup = [setups[i] for i in index[block]]
+            R_part, K_part, k_well = (np.array(val) for val in zip(*setup))
+            S_part = np.broadcast_to(paras[block, :1], K_part.shape)
+            rep = len(nodes)
+            lap = grf_laplace_batch(
+                s=np.tile(nodes, len(block)),
+                S_part=np.repeat(S_part, rep, axis=0),
+                K_part=np.repeat(K_part, rep, axis=0),
+                R_part=np.repeat(R_part, rep, axis=0),
+                K_well=np.repeat(k_well, rep),
+                **kw,
+            ).reshape(len(block), len(t_fac), 12, len(rad))
+            head[block[:, None], time_gz] = (
+                np.einsum("ptjr,j->ptr", lap, c_fac) * t_fac[:, None]
+            )
+    if return_parts:
+        return head + h_bound, counts
+    return head + h_bound
@@ -0,0 +1,258 @@
+"""Tabulated coarse-graining conductivity of truncated power law fields."""
+import os
+import functools
+import numpy as np
+from scipy.special import hyp2f1
+from scipy.interpolate import make_interp_spline
+from anaflow.tools.special import aniso
+
+# default table file (independent of the working directory)
+TABLE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "results",
+    "cache",
+    "tpl_cg_table.npz",
+)
+
+
+def tpl_exponent(log_s, hurst, dim):
+    """
+    Normalized exponent of the TPL coarse-graining conductivity.
+
+    ``TPL_CG = K_efu * exp(chi * tpl_exponent(log(s), hurst, dim))`` with the
+    dimensionless radius ``s = prop * r / len_scale``. It is ``1`` at the
+    well and decays to ``0`` in the far field.
+    """
+    x = 1.0 / (1.0 + np.exp(2.0 * np.asarray(log_s, dtype=float)))
+    hyp = hyp2f1(dim / 2.0, 1, dim / 2.0 + 1 + hurst, x)
+    return 2.0 * hurst / (dim + 2.0 * hurst) * x ** (dim / 2.0) * hyp
+
+
+def _lagrange(grid, value):
+    """Start index and weights of the cubic Lagrange interpolation."""
+    start = int(np.clip(np.searchsorted(grid, value) - 2, 0, len(grid) - 4))
+    nodes = grid[start : start + 4]
+    weights = np.ones(4)
+    for k in range(4):
+        for j in range(4):
+            if j != k:
+                weights[k] *= (value - nodes[j]) / (nodes[k] - nodes[j])
+    return start, weights
+
+
+class TPLTable:
+    """
+    Lookup table of the normalized TPL coarse-graining conductivity.
+
+    The exponent :any:`tpl_exponent` is tabulated over the logarithm of the
+    dimensionless radius, the hurst coefficient and the dimension. For a
+    given hurst coefficient and dimension, the values are interpolated by
+    cubic Lagrange polynomials in both parameters and a cubic spline over
+    the radius is set up (the recently used ones are kept). The
+    interpolation error is measured at the cell midpoints of all three
+    axes when the table is built and stored with the table. Radii outside
+    the table range and hurst coefficients below ``hurst_min`` are
+    evaluated exactly.
+
+    The table is built and saved on first use, if the file is missing or
+    less accurate than requested, and loaded lazily otherwise.
+
+    Parameters
+    ----------
+    path : :class:`str`, optional
+        Table file. Default: ``results/cache/tpl_cg_table.npz``
+    tol : :class:`float`, optional
+        Maximal absolute interpolation error of the exponent. The relative
+        error of the conductivity is below ``abs(chi) * tol``.
+        Default: ``1e-5``
+    size : :class:`tuple` of :class:`int`, optional
+        Number of nodes for the radius, hurst and dim. Doubled until the
+        tolerance is met. Default: ``(257, 49, 49)``
+    s_range : :class:`tuple` of :class:`float`, optional
+        Range of the dimensionless radius. Default: ``(1e-4, 1e4)``
+    hurst_min : :class:`float`, optional
+        Smallest tabulated hurst coefficient. Default: ``0.01``
+    max_curves : :class:`int`, optional
+        Number of kept splines (least recently used are dropped).
+        Default: ``64``
+    """
+
+    def __init__(
+        self,
+        path=TABLE_FILE,
+        tol=1e-5,
+        size=(257, 49, 49),
+        s_range=(1e-4, 1e4),
+        hurst_min=0.01,
+        max_curves=64,
+    ):
+        self.path = path
+        self.tol = float(tol)
+        self.size = tuple(size)
+        self.s_range = tuple(s_range)
+        self.hurst_min = float(hurst_min)
+        self.log_s, self.hurst, self.dim = None, None, None
+        self.values, self.error = None, None
+        # splines over the radius for the recently used hurst and dim
+        self.curve = functools.lru_cache(max_curves)(self._curve)
+
+    def grids(self, size):
+        """Nodes of the radius, hurst (dense for small values) and dim axes."""
+        log_s = np.linspace(*np.log(self.s_range), size[0])
+        shift = 0.05  # nodes geometric in hurst + shift
+        hurst = np.linspace(
+            np.log(self.hurst_min + shift), np.log(1 + shift), size[1]
+        )
+        return log_s, np.exp(hurst) - shift, np.linspace(1, 3, size[2])
+
+    def build(self):
+        """Tabulate the exponent and measure the interpolation error."""
+        size = self.size
+        while True:
+            self.log_s, self.hurst, self.dim = self.grids(size)
+            self.values = tpl_exponent(
+                self.log_s[:, None, None], self.hurst[:, None], self.dim
+            )
+            self.finite()
+            self.curve.cache_clear()
+            self.error = self.check()
+            self.curve.cache_clear()
+            print(
+                "TPLTable: {} nodes, max. error {:.2e}".format(size, self.error)
+            )
+            if self.error <= self.tol:
+                return
+            size = tuple(2 * (n - 1) + 1 for n in size)
+
+    def finite(self):
+        """Raise an error if the tabulated values are not finite."""
+        i, j, k = np.nonzero(~np.isfinite(self.values))
+        if i.size:
+            raise ValueError(
+                "TPLTable: hyp2f1 not finite for s in [{:.3g}, {:.3g}], "
+                "hurst in [{:.3g}, {:.3g}], dim in [{:.3g}, {:.3g}]".format(
+                    *np.exp(self.log_s[[i.min(), i.max()]]),
+                    *self.hurst[[j.min(), j.max()]],
+                    *self.dim[[k.min(), k.max()]],
+                )
+            )
+
+    def check(self):
+        """Maximal interpolation error at the cell midpoints of all axes."""
+        log_s = (self.log_s[1:] + self.log_s[:-1]) / 2
+        hurst = (self.hurst[1:] + self.hurst[:-1]) / 2
+        dim = (self.dim[1:] + self.dim[:-1]) / 2
+        error = 0.0
+        for hur in hurst:
+            for dim_ in dim:
+                exact = tpl_exponent(log_s, hur, dim_)
+                if not np.all(np.isfinite(exact)):
+                    raise ValueError(
+                        "TPLTable: hyp2f1 not finite for hurst {:.3g}, "
+                        "dim {:.3g}".format(hur, dim_)
+                    )
+                diff = self.curve(hur, dim_)(log_s) - exact
+                error = max(error, np.max(np.abs(diff)))
+        return error
+
+    def save(self):
+        """Save the table (atomically)."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".{}.tmp".format(os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                log_s=self.log_s,
+                hurst=self.hurst,
+                dim=self.dim,
+                values=self.values,
+                error=self.error,
+                hurst_min=self.hurst_min,
+            )
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """Load the table or build it, if missing or not accurate enough."""
+        if self.values is not None:
+            return
+        try:
+            with np.load(self.path) as table:
+                valid = (
+                    table["error"] <= self.tol
+                    and table["hurst_min"] <= self.hurst_min
+                    and np.allclose(table["log_s"][[0, -1]], np.log(self.s_range))
+                    and np.all(np.isfinite(table["values"]))
+                )
+                if valid:
+                    self.log_s, self.hurst = table["log_s"], table["hurst"]
+                    self.dim, self.values = table["dim"], table["values"]
+                    self.error = float(table["error"])
+                    return
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            pass
+        self.build()
+        self.save()
+
+    def _curve(self, hurst, dim):
+        """Spline of the exponent over the log-radius for hurst and dim."""
+        i, w_h = _lagrange(self.hurst, hurst)
+        j, w_d = _lagrange(self.dim, dim)
+        values = self.values[:, i : i + 4, j : j + 4] @ w_d @ w_h
+        return make_interp_spline(self.log_s, values, k=3)
+
+    def exponent(self, s, hurst, dim):
+        """Exponent for the dimensionless radii (tabulated if in range)."""
+        s = np.array(s, dtype=float, ndmin=1)
+        result = np.ones_like(s)  # at the well
+        exact = s > 0
+        if hurst >= self.hurst_min and 1 <= dim <= 3:
+            self.load()
+            inner = (s >= self.s_range[0]) & (s <= self.s_range[1])
+            curve = self.curve(float(hurst), float(dim))
+            result[inner] = curve(np.log(s[inner]))
+            exact &= ~inner
+        if np.any(exact):
+            with np.errstate(over="ignore"):
+                result[exact] = tpl_exponent(np.log(s[exact]), hurst, dim)
+        return result
+
+
+TABLE = TPLTable()
+
+
+def TPL_CG(
+    rad,
+    cond_gmean,
+    len_scale,
+    hurst,
+    var=None,
+    c=1.0,
+    anis=1,
+    dim=2.0,
+    K_well="KH",
+    prop=1.6,
+):
+    """
+    Tabulated TPL coarse-graining conductivity.
+
+    Drop-in replacement of :any:`anaflow.tools.coarse_graining.TPL_CG`
+    evaluating the hypergeometric function by the lookup table
+    :any:`TABLE` (see :any:`TPLTable`).
+    """
+    # handle special case in 3D with anisotropy (like in AnaFlow)
+    is_3d = abs(dim - 3.0) <= 1e-8 + 1e-5 * 3.0  # np.isclose(dim, 3)
+    anis = 1.0 if not is_3d else anis
+    ani = aniso(anis) if is_3d else 1.0 / dim
+    var = c * len_scale ** (2 * hurst) / (2 * hurst) if var is None else var
+    K_efu = cond_gmean * np.exp(var * (0.5 - ani))
+    if K_well == "KH":
+        chi = var * (ani - 1.0)
+    elif K_well == "KA":
+        chi = var * ani
+    else:
+        chi = np.log(K_well / K_efu)
+    rad = np.asarray(rad, dtype=float)
+    s = prop * rad / (len_scale * anis ** (1 / 3.0))
+    exponent = TABLE.exponent(s, hurst, dim).reshape(rad.shape)
+    return K_efu * np.exp(chi * exponent)